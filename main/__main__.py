@@ -0,0 +1,49 @@
+"""
+Запуск FastApi в нескольких процессах: python -m main из корня репозитория.
+Приложение импортируется только в воркерах, поэтому каждый из них создает свой
+движок базы данных. Метрики /metrics тоже у каждого воркера свои
+"""
+
+import os
+from importlib.util import find_spec
+
+import uvicorn
+from dotenv import find_dotenv, load_dotenv
+from loguru import logger
+
+load_dotenv(find_dotenv())
+
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", 8088))
+# 0 - по числу ядер
+API_WORKERS = int(os.getenv("API_WORKERS", 1))
+API_ACCESS_LOG = os.getenv("API_ACCESS_LOG", "1") == "1"
+
+
+def serve() -> None:
+    """
+    Запуск API_WORKERS процессов uvicorn. У каждого воркера свой пул соединений, поэтому
+    всего к базе данных открывается до API_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW) соединений
+    """
+    workers = API_WORKERS or os.cpu_count() or 1
+    if workers > 1:
+        # изменение сбрасывает кэш /api/user только в одном воркере, а остальные
+        # отдавали бы устаревшие данные до истечения USER_CACHE_TTL
+        os.environ["USER_CACHE_SIZE"] = "0"
+        logger.info("Кэш /api/user отключен: воркеров больше одного")
+    loop = "uvloop" if find_spec("uvloop") else "asyncio"
+    http = "httptools" if find_spec("httptools") else "h11"
+    logger.info(f"Запуск воркеров uvicorn: {workers}, цикл событий {loop}, HTTP-парсер {http}")
+    uvicorn.run(
+        "main.app:app",
+        host=API_HOST,
+        port=API_PORT,
+        workers=workers,
+        loop=loop,
+        http=http,
+        access_log=API_ACCESS_LOG,
+    )
+
+
+if __name__ == "__main__":
+    serve()
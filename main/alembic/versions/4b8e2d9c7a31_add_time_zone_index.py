@@ -0,0 +1,39 @@
+"""add time_zone index
+
+Revision ID: 4b8e2d9c7a31
+Revises: 1cfef68f5933
+Create Date: 2026-10-17 12:10:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4b8e2d9c7a31"
+down_revision: Union[str, Sequence[str], None] = "1cfef68f5933"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # индекс строится без блокировки записи в таблицу user
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_user_time_zone"),
+            "user",
+            ["time_zone"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_user_time_zone"), table_name="user", postgresql_concurrently=True
+        )
@@ -0,0 +1,129 @@
+"""add habit and habit_completion tables
+
+Revision ID: c3a7f19d2e64
+Revises: 4b8e2d9c7a31
+Create Date: 2026-10-17 13:20:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c3a7f19d2e64"
+down_revision: Union[str, Sequence[str], None] = "4b8e2d9c7a31"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# количество пользователей, переносимых одной транзакцией
+BATCH_SIZE = 5000
+
+BATCH_BOUNDS = sa.text(
+    """
+    SELECT max(id) FROM (
+        SELECT id FROM "user" WHERE id > :after ORDER BY id LIMIT :size
+    ) AS batch
+    """
+)
+
+# один пакет - один запрос: привычки из habits имеют приоритет над одноименными из completed,
+# а позиция переноса сохраняется в habit_backfill атомарно вместе со вставкой
+BACKFILL_BATCH = sa.text(
+    """
+    WITH moved AS (
+        INSERT INTO habit (user_id, name, count, completed_at)
+        SELECT DISTINCT ON (user_id, name) user_id, name, count, completed_at
+        FROM (
+            SELECT u.id AS user_id, h.key AS name, h.value::int AS count,
+                   NULL::timestamp AS completed_at, 0 AS priority
+            FROM "user" AS u, jsonb_each_text(coalesce(u.habits, '{}'::jsonb)) AS h
+            WHERE u.id > :after AND u.id <= :upto
+            UNION ALL
+            SELECT u.id, c.value, coalesce(u.repeat_number, 21),
+                   coalesce(u.date_changed, now()), 1
+            FROM "user" AS u, jsonb_array_elements_text(coalesce(u.completed, '[]'::jsonb)) AS c
+            WHERE u.id > :after AND u.id <= :upto
+        ) AS source
+        ORDER BY user_id, name, priority
+        ON CONFLICT ON CONSTRAINT uq_habit_user_id_name DO NOTHING
+    )
+    UPDATE habit_backfill SET last_user_id = :upto
+    """
+)
+
+
+def backfill() -> None:
+    """
+    Перенос привычек из JSONB-колонок пакетами по BATCH_SIZE пользователей, каждый пакет
+    отдельной транзакцией. Прерванный перенос при повторном запуске продолжается с позиции,
+    сохраненной в habit_backfill. Строки, уже записанные приложением, не перезаписываются
+    """
+    connection = op.get_bind()
+    connection.execute(
+        sa.text("CREATE TABLE IF NOT EXISTS habit_backfill (last_user_id integer NOT NULL)")
+    )
+    connection.execute(
+        sa.text(
+            "INSERT INTO habit_backfill SELECT 0 "
+            "WHERE NOT EXISTS (SELECT 1 FROM habit_backfill)"
+        )
+    )
+    after = connection.execute(sa.text("SELECT last_user_id FROM habit_backfill")).scalar()
+    while True:
+        upto = connection.execute(
+            BATCH_BOUNDS, {"after": after, "size": BATCH_SIZE}
+        ).scalar()
+        if upto is None:
+            break
+        connection.execute(BACKFILL_BATCH, {"after": after, "upto": upto})
+        after = upto
+    connection.execute(sa.text("DROP TABLE habit_backfill"))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if "habit" not in existing:
+        op.create_table(
+            "habit",
+            sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("name", sa.Text(), nullable=False),
+            sa.Column("count", sa.Integer(), nullable=False),
+            sa.Column("completed_at", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("user_id", "name", name="uq_habit_user_id_name"),
+        )
+        op.create_index(
+            "ix_habit_user_id_completed_at", "habit", ["user_id", "completed_at"]
+        )
+    if "habit_completion" not in existing:
+        op.create_table(
+            "habit_completion",
+            sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+            sa.Column("habit_id", sa.Integer(), nullable=False),
+            sa.Column("completed_at", sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(["habit_id"], ["habit.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            "ix_habit_completion_habit_id_completed_at",
+            "habit_completion",
+            ["habit_id", "completed_at"],
+        )
+    with op.get_context().autocommit_block():
+        backfill()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "ix_habit_completion_habit_id_completed_at", table_name="habit_completion"
+    )
+    op.drop_table("habit_completion")
+    op.drop_index("ix_habit_user_id_completed_at", table_name="habit")
+    op.drop_table("habit")
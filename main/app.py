@@ -1,27 +1,59 @@
+import asyncio
 import os
 import sys
-import time
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import AsyncGenerator
 
-import uvicorn
-from asyncpg.exceptions import CannotConnectNowError, UniqueViolationError
+from asyncpg.exceptions import UniqueViolationError
 from dotenv import find_dotenv, load_dotenv
 from fastapi import Depends, FastAPI, Header, Request
 from fastapi.exceptions import RequestValidationError, ResponseValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from loguru import logger
 from sqlalchemy import (
+    BigInteger,
+    DateTime,
+    Integer,
+    Text,
+    any_,
+    bindparam,
+    case,
+    cast,
+    column,
+    func,
+    literal,
+    or_,
     select,
     update,
+    values,
 )
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, array
 from sqlalchemy.exc import IntegrityError, ResourceClosedError
-from sqlalchemy.ext.asyncio import AsyncSession
-
-from main.schemas import BaseUser, GetUser, UserPatch
-from main.models import User
-from main.database import AsyncSessionLocal, Base, engine, session
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.sql.dml import Update
+
+from main.responses import OrjsonResponse, dumps
+from main.schemas import (
+    BaseUser,
+    BatchGet,
+    BatchPatch,
+    GetUser,
+    HabitComplete,
+    UserPatch,
+)
+from main.cache import UserCache
+from main.metrics import Gauge, MetricsMiddleware, render
+from main.habits import log_completion, sync_user_habits
+from main.health import HealthState, check_database, wait_for_database
+from main.models import USER_JSON_COLUMNS, User
+from main.database import AsyncSessionLocal, Base, get_engine
 
 load_dotenv(find_dotenv())
 
@@ -32,7 +64,19 @@ logger.level("WARNING", color="<fg 10,190,200>")
 
 
 status_code_error = 400
+stream_batch_size = 1000
+# наибольший размер страницы limit в /api/get_users и /api/due_users
+max_page_size = 10000
 token = os.getenv("token")
+statement_cache_size = 128
+user_cache = UserCache()
+health = HealthState()
+
+# запросы горячих эндпоинтов чтения строятся один раз при импорте
+users_columns_name = frozenset(User.__table__.columns.keys())
+user_by_uid = select(*(User.__table__.c[name] for name in USER_JSON_COLUMNS)).where(
+    User.tg_uid == bindparam("tg_uid")
+)
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
@@ -40,31 +84,47 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+async def get_connection() -> AsyncGenerator[AsyncConnection, None]:
+    """
+    Соединение из пула для чтения через Core без сессии ORM и identity map
+    """
+    async with get_engine().connect() as connection:
+        yield connection
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    lifespan
+    Подключение к базе данных выполняется в фоне, поэтому приложение сразу отвечает
+    на /health/live, а /health/ready возвращает 503, пока база недоступна
     """
-    try:
-        logger.info("startup")
-        async with engine.begin() as conn:
-            # await conn.run_sync(Base.metadata.drop_all)
-            await conn.run_sync(Base.metadata.create_all)
-        yield
-    except (ConnectionRefusedError, ConnectionError, CannotConnectNowError) as ex:
-        logger.error(ex)
-        logger.info("Ждем окончания инициализации базы данных")
-        time.sleep(10)
-        async with engine.begin() as conn:
-            # await conn.run_sync(Base.metadata.drop_all)
-            await conn.run_sync(Base.metadata.create_all)
-        yield
+    logger.info("startup")
+    health.reset()
+    startup = asyncio.create_task(wait_for_database(get_engine(), Base.metadata, health))
+    yield
     logger.info("Shutdown")
-    await session.close()
-    await engine.dispose()
+    health.draining = True
+    startup.cancel()
+    await get_engine().dispose()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+Gauge(
+    "db_pool_connections",
+    "Соединения пула базы данных по состоянию",
+    ("state",),
+    collect=lambda: {
+        ("checked_out",): get_engine().pool.checkedout(),
+        ("idle",): get_engine().pool.checkedin(),
+    },
+)
+Gauge(
+    "user_cache_entries",
+    "Записи в кэше /api/user",
+    collect=lambda: {(): len(user_cache.data)},
+)
 
 
 class AuthorizationError(Exception):
@@ -75,6 +135,14 @@ class UserNotFound(Exception):
     args = ("Пользователь не найден",)
 
 
+class HabitNotFound(Exception):
+    args = ("Привычка не найдена",)
+
+
+class InvalidHours(Exception):
+    args = ("Часы уведомлений задаются числами от 0 до 23 через пробел",)
+
+
 @app.exception_handler(AuthorizationError)
 async def custom_api_exception_handler(request: Request, exc: AuthorizationError):
     """
@@ -132,57 +200,179 @@ def errors(ex) -> dict:
 
 
 @app.get(
-    "/api/user", description="Получить данные пользователя", response_model=GetUser
+    "/api/user",
+    description="Получить данные пользователя",
+    response_model=None,
+    responses={200: {"model": GetUser}},
 )
 async def get_user(
     tg_uid: int = Header(...),
     authorization_token: str = Header(...),
-    session=Depends(get_session),
 ):
     try:
         if authorization_token != token:
             raise AuthorizationError()
-        async with session.begin():
-            user = await session.execute(select(User).filter_by(tg_uid=tg_uid))
 
-        user_out = user.scalar_one_or_none()
-        if not user_out:
+        async def load_user():
+            # соединение берется из пула только при промахе кэша
+            async with get_engine().connect() as connection:
+                user = await connection.execute(user_by_uid, {"tg_uid": tg_uid})
+                user_out = user.mappings().first()
+            return dumps({"user": dict(user_out), "result": True}) if user_out else None
+
+        user_json = await user_cache.get(tg_uid, load_user)
+        if not user_json:
             raise UserNotFound()
-        return user_out.to_json()
+        return Response(user_json, media_type="application/json")
 
     except (AuthorizationError, UserNotFound) as ex:
         return errors(ex)
 
 
+def uids_array(tg_uids: list):
+    """
+    Список tg_uid одним параметром-массивом для условия tg_uid = ANY(...)
+    """
+    return literal(tg_uids, ARRAY(BigInteger))
+
+
+def users_columns(attrib: str) -> list:
+    """
+    Колонки таблицы user для перечисленных через пробел атрибутов
+    """
+    return [
+        getattr(User, name) if name in users_columns_name else User.id
+        for name in attrib.split()
+    ]
+
+
+@lru_cache(maxsize=statement_cache_size)
+def users_page_statement(attrib: str):
+    """
+    Запрос страницы пользователей для набора атрибутов. Готовые запросы переиспользуются,
+    а их SQL-текст совпадает между вызовами, поэтому asyncpg берет подготовленный
+    запрос из своего кэша
+    """
+    return (
+        select(*users_columns(attrib), User.id.label("_cursor"))
+        .where(User.id > bindparam("after_id"))
+        .order_by(User.id)
+        .limit(bindparam("limit", type_=Integer))
+    )
+
+
 @app.get(
     "/api/get_users",
-    description="Получить список всех пользователй с необходимыми атрибутами",
+    description="Получить список всех пользователй с необходимыми атрибутами. "
+    "При передаче limit (от 1 до 10000) возвращается страница из limit пользователей "
+    "с id больше after-id и курсор next_cursor для следующей страницы",
 )
 async def get_all_users(
     attrib: str = Header(...),
     authorization_token: str = Header(...),
-    session=Depends(get_session),
+    after_id: int = Header(0),
+    limit: int | None = Header(None, ge=1, le=max_page_size),
+    connection=Depends(get_connection),
 ):
     try:
-        print(attrib.split())
-        columns_name = [column.name for column in User.__table__.columns]
-        params_to_stmt = [
-            getattr(User, name) if name in columns_name else User.id
-            for name in attrib.split()
-        ]
         if authorization_token != token:
             raise AuthorizationError()
-        async with session.begin():
-            users = await session.execute(select(*params_to_stmt))
+        users = await connection.execute(
+            users_page_statement(attrib), {"after_id": after_id, "limit": limit}
+        )
         users_out = users.mappings().all()
-        if not users_out:
+        if not users_out and not after_id:
             raise UserNotFound()
-        print(users_out)
-        return {"result": True, "users": users_out}
+        next_cursor = (
+            users_out[-1]["_cursor"] if limit and len(users_out) == limit else None
+        )
+        return OrjsonResponse(
+            {
+                "result": True,
+                "users": [
+                    {key: value for key, value in row.items() if key != "_cursor"}
+                    for row in users_out
+                ],
+                "next_cursor": next_cursor,
+            }
+        )
     except (AuthorizationError, UserNotFound, ResourceClosedError) as ex:
         return errors(ex)
 
 
+@app.get(
+    "/api/get_users/stream",
+    description="Потоковая выгрузка пользователей с необходимыми атрибутами в формате NDJSON "
+    "(по одному объекту JSON на строку) через серверный курсор базы данных",
+)
+async def stream_all_users(
+    attrib: str = Header(...),
+    authorization_token: str = Header(...),
+):
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+    except AuthorizationError as ex:
+        return errors(ex)
+    stmt = select(*users_columns(attrib)).order_by(User.id)
+
+    async def rows() -> AsyncGenerator[str, None]:
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(
+                stmt.execution_options(yield_per=stream_batch_size)
+            )
+            async for partition in result.mappings().partitions():
+                yield b"".join(dumps(dict(row)) + b"\n" for row in partition)
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+@app.get(
+    "/api/due_users",
+    description="Получить tg_uid пользователей, у которых в переданный час UTC наступает "
+    "локальное время уведомления. Часы уведомлений задаются в Header local-hours через пробел",
+)
+async def get_due_users(
+    authorization_token: str = Header(...),
+    utc_hour: int | None = Header(None, ge=0, le=23),
+    local_hours: str = Header("12 18"),
+    after_id: int = Header(0),
+    limit: int | None = Header(None, ge=1, le=max_page_size),
+    session=Depends(get_session),
+):
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+        if utc_hour is None:
+            utc_hour = datetime.now(timezone.utc).hour
+        hours = local_hours.split()
+        if not hours or not all(hour.isdecimal() and int(hour) < 24 for hour in hours):
+            raise InvalidHours()
+        offsets = {(int(hour) - utc_hour) % 24 for hour in hours}
+        time_zones = offsets | {offset - 24 for offset in offsets}
+        condition = User.time_zone.in_(time_zones)
+        if 0 in time_zones:
+            condition = or_(condition, User.time_zone.is_(None))
+        stmt = (
+            select(User.id, User.tg_uid)
+            .where(condition, User.id > after_id)
+            .order_by(User.id)
+            .limit(limit)
+        )
+        async with session.begin():
+            users = (await session.execute(stmt)).all()
+        next_cursor = users[-1].id if limit and len(users) == limit else None
+        return {
+            "result": True,
+            "users": [user.tg_uid for user in users],
+            "next_cursor": next_cursor,
+        }
+    except InvalidHours as ex:
+        return JSONResponse(errors(ex), status_code=422)
+    except AuthorizationError as ex:
+        return errors(ex)
+
+
 @app.post("/api/make_user", description="Создание пользователя", response_model=GetUser)
 async def make_user(
     user: BaseUser, authorization_token: str = Header(...), session=Depends(get_session)
@@ -194,7 +384,11 @@ async def make_user(
             new_user = User(**user.dict())
             # print(user.dict())
             session.add(new_user)
+            if user.habits or user.completed:
+                await session.flush()
+                await sync_user_habits(session, user.tg_uid)
             # await session.commit()
+        user_cache.invalidate(user.tg_uid)
         return new_user.to_json()
     except (AuthorizationError, IntegrityError, UniqueViolationError) as ex:
         return errors(ex)
@@ -224,7 +418,10 @@ async def change_user(
                 .returning(User)
             )
             if result.scalars().one_or_none():
+                if data_in.habits is not None or data_in.completed is not None:
+                    await sync_user_habits(session, tg_uid)
                 await session.commit()
+                user_cache.invalidate(tg_uid)
             else:
                 raise UserNotFound()
             return {"result": True}
@@ -232,6 +429,185 @@ async def change_user(
         return errors(ex)
 
 
+@app.post(
+    "/api/users/batch_get",
+    description="Получить данные нескольких пользователей одним запросом",
+)
+async def batch_get_users(
+    data_in: BatchGet,
+    authorization_token: str = Header(...),
+    session=Depends(get_session),
+):
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+        async with session.begin():
+            users = await session.execute(
+                select(User).where(User.tg_uid == any_(uids_array(data_in.tg_uids)))
+            )
+        found = {user.tg_uid: user.to_json() for user in users.scalars()}
+        return {
+            "result": True,
+            "users": [
+                found.get(tg_uid, errors(UserNotFound())) | {"tg_uid": tg_uid}
+                for tg_uid in data_in.tg_uids
+            ],
+        }
+    except AuthorizationError as ex:
+        return errors(ex)
+
+
+def batch_patch_statement(rows: list) -> Update:
+    """
+    UPDATE ... FROM (VALUES ...) для batch_change. Значения None передаются как NULL без типа,
+    и если столбец пуст во всех строках, Postgres считает его text, поэтому каждый столбец
+    patch явно приводится к типу столбца user
+    """
+    patch_values = values(
+        column("tg_uid", BigInteger),
+        column("habits", JSONB(none_as_null=True)),
+        column("completed", JSONB(none_as_null=True)),
+        column("repeat_number", Integer),
+        column("date_changed", DateTime),
+        column("time_zone", Integer),
+        name="patch",
+    ).data(rows)
+    return (
+        update(User)
+        .where(User.tg_uid == patch_values.c.tg_uid)
+        .values(
+            {
+                name: func.coalesce(
+                    cast(patch_values.c[name], patch_values.c[name].type),
+                    User.__table__.c[name],
+                )
+                for name in ("habits", "completed", "repeat_number", "date_changed", "time_zone")
+            }
+        )
+        .returning(User.tg_uid)
+    )
+
+
+@app.patch(
+    "/api/users/batch_change",
+    description="Изменение данных нескольких пользователей одним запросом UPDATE ... FROM (VALUES ...)",
+)
+async def batch_change_users(
+    data_in: BatchPatch,
+    authorization_token: str = Header(...),
+    session=Depends(get_session),
+):
+    """
+    Функция изменения данных пользователей одной транзакцией. Как и в change_user,
+    изменяются только переданные значения (не None). Результат возвращается для каждого tg_uid
+    """
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+        now = datetime.now()
+        patches = {patch.tg_uid: patch for patch in data_in.users}
+        rows = [
+            (
+                patch.tg_uid,
+                patch.habits,
+                patch.completed,
+                patch.repeat_number,
+                now if patch.habits is not None else patch.date_changed,
+                patch.time_zone,
+            )
+            for patch in patches.values()
+        ]
+        stmt = batch_patch_statement(rows)
+        async with session.begin():
+            updated = set((await session.execute(stmt)).scalars())
+            habits_changed = [
+                tg_uid
+                for tg_uid in updated
+                if patches[tg_uid].habits is not None
+                or patches[tg_uid].completed is not None
+            ]
+            if habits_changed:
+                await sync_user_habits(session, *habits_changed)
+        for tg_uid in updated:
+            user_cache.invalidate(tg_uid)
+        return {
+            "result": True,
+            "users": [
+                {"tg_uid": tg_uid, "result": True}
+                if tg_uid in updated
+                else errors(UserNotFound()) | {"tg_uid": tg_uid}
+                for tg_uid in patches
+            ],
+        }
+    except AuthorizationError as ex:
+        return errors(ex)
+
+
+@app.patch(
+    "/api/complete_habit",
+    description="Отметка выполнения привычки одним запросом UPDATE ... RETURNING",
+)
+async def complete_habit(
+    data_in: HabitComplete,
+    authorization_token: str = Header(...),
+    session=Depends(get_session),
+):
+    """
+    Функция увеличивает счетчик привычки на месте через jsonb_set. При достижении repeat_number
+    привычка переносится из habits в completed. Возвращает новое состояние привычек пользователя
+    """
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+        habit = data_in.habit
+        count = User.habits[habit].as_integer() + 1
+        done = count >= User.repeat_number
+        stmt = (
+            update(User)
+            .where(User.tg_uid == data_in.tg_uid, User.habits.has_key(habit))
+            .values(
+                habits=case(
+                    (done, User.habits.op("-")(habit)),
+                    else_=func.jsonb_set(
+                        User.habits, array([habit], type_=Text), func.to_jsonb(count)
+                    ),
+                ),
+                completed=case(
+                    (
+                        done,
+                        func.coalesce(User.completed, cast([], JSONB)).concat(
+                            func.jsonb_build_array(habit)
+                        ),
+                    ),
+                    else_=User.completed,
+                ),
+                date_changed=datetime.now(),
+            )
+            .returning(User.id, User.habits, User.completed, User.repeat_number)
+        )
+        async with session.begin():
+            result = (await session.execute(stmt)).one_or_none()
+            if result is None:
+                exists = await session.execute(
+                    select(User.id).filter_by(tg_uid=data_in.tg_uid)
+                )
+                raise HabitNotFound() if exists.first() else UserNotFound()
+            done = habit not in result.habits
+            count = result.habits.get(habit, result.repeat_number)
+            await log_completion(session, result.id, habit, count, done)
+        user_cache.invalidate(data_in.tg_uid)
+        return {
+            "result": True,
+            "done": done,
+            "count": count,
+            "habits": result.habits,
+            "completed": result.completed,
+            "repeat_number": result.repeat_number,
+        }
+    except (AuthorizationError, UserNotFound, HabitNotFound) as ex:
+        return errors(ex)
+
+
 @app.delete("/api/delete_user", description="Удаление пользователя")
 async def delete_user(
     tg_uid: int = Header(...),
@@ -247,6 +623,7 @@ async def delete_user(
             if user:
                 await session.delete(user)
                 await session.commit()
+                user_cache.invalidate(tg_uid)
             else:
                 raise UserNotFound()
         return {"result": True}
@@ -254,6 +631,56 @@ async def delete_user(
         return errors(ex)
 
 
-if __name__ == "__main__":
-    port = 8088
-    uvicorn.run("app:app", port=port)
+@app.get("/api/cache_stats", description="Статистика кэша /api/user")
+async def cache_stats(authorization_token: str = Header(...)):
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+        return {"result": True, "cache": user_cache.stats()}
+    except AuthorizationError as ex:
+        return errors(ex)
+
+
+@app.get(
+    "/api/pool_stats",
+    description="Состояние пула соединений с базой данных: занятые и свободные соединения, "
+    "время ожидания соединения",
+)
+async def pool_stats(authorization_token: str = Header(...)):
+    try:
+        if authorization_token != token:
+            raise AuthorizationError()
+        return {"result": True, "pool": get_engine().pool.stats()}
+    except AuthorizationError as ex:
+        return errors(ex)
+
+
+@app.get("/health/live", description="Процесс запущен и обрабатывает запросы")
+async def health_live():
+    return {"result": True}
+
+
+@app.get(
+    "/health/ready",
+    description="Приложение готово принимать запросы: база данных доступна и схема подготовлена",
+)
+async def health_ready():
+    error = health.error
+    if health.ready and not health.draining:
+        error = await check_database(get_engine())
+        if error is None:
+            return {"result": True, "health": health.stats()}
+    return JSONResponse(
+        status_code=503,
+        content={"result": False, "health": health.stats() | {"error": error}},
+    )
+
+
+@app.get(
+    "/metrics",
+    description="Метрики в текстовом формате Prometheus. При нескольких воркерах "
+    "значения относятся к воркеру, ответившему на запрос",
+    response_class=PlainTextResponse,
+)
+async def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,105 @@
+"""
+Микробенчмарк сериализации ответов /api/user и /api/get_users: прежний путь
+(обход __table__.columns, проверка GetUser, jsonable_encoder и стандартный json)
+против нового (заранее вычисленный список колонок и orjson без проверки response_model).
+База данных не нужна: замеряется только время CPU на формирование тела ответа.
+
+Запуск из корня репозитория:
+    python -m main.benchmarks.serialization_benchmark --rows 1000 --repeat 2000
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from main.models import User
+from main.responses import OrjsonResponse, dumps
+from main.schemas import GetUser
+
+
+def make_user(tg_uid: int) -> User:
+    return User(
+        id=tg_uid,
+        tg_uid=tg_uid,
+        habits={f"привычка {number}": 21 - number for number in range(5)},
+        repeat_number=21,
+        date_changed=datetime(2026, 10, 17, 12, 30),
+        completed=[f"выполнено {number}" for number in range(3)],
+        time_zone=3,
+    )
+
+
+def old_user_body(user: User) -> bytes:
+    result_json = {
+        column.name: getattr(user, column.name)
+        for column in user.__table__.columns
+        if column.name != "id"
+    }
+    content = {"user": result_json, "result": True}
+    validated = GetUser.model_validate(content)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def new_user_body(user: User) -> bytes:
+    return dumps(user.to_json())
+
+
+def old_users_body(rows: list) -> bytes:
+    return JSONResponse(
+        jsonable_encoder({"result": True, "users": rows, "next_cursor": None})
+    ).body
+
+
+def new_users_body(rows: list) -> bytes:
+    return OrjsonResponse({"result": True, "users": rows, "next_cursor": None}).body
+
+
+def measure(func, arg, repeat: int) -> float:
+    """
+    Среднее время CPU одного вызова в микросекундах
+    """
+    func(arg)
+    start = time.process_time()
+    for _ in range(repeat):
+        func(arg)
+    return (time.process_time() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000, help="строк в ответе get_users")
+    parser.add_argument("--repeat", type=int, default=2000, help="повторов для /api/user")
+    args = parser.parse_args()
+
+    user = make_user(1)
+    assert json.loads(old_user_body(user)) == json.loads(new_user_body(user))
+
+    rows = [
+        {"tg_uid": uid, "time_zone": uid % 24, "date_changed": datetime(2026, 10, 17)}
+        for uid in range(args.rows)
+    ]
+    assert json.loads(old_users_body(rows)) == json.loads(new_users_body(rows))
+
+    users_repeat = max(args.repeat * 10 // max(args.rows, 1), 10)
+    result = {}
+    for name, old, new, arg, repeat in (
+        ("/api/user", old_user_body, new_user_body, user, args.repeat),
+        ("/api/get_users", old_users_body, new_users_body, rows, users_repeat),
+    ):
+        old_us = measure(old, arg, repeat)
+        new_us = measure(new, arg, repeat)
+        result[name] = {
+            "old_us": round(old_us, 2),
+            "new_us": round(new_us, 2),
+            "speedup": round(old_us / new_us, 2),
+        }
+    result["get_users_rows"] = args.rows
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 30))
+
+
+class UserCache:
+    """
+    Кэш сериализованных ответов /api/user в памяти процесса: LRU с ограничением по количеству записей и TTL.
+    Одновременные промахи по одному tg_uid объединяются в один запрос к базе данных.
+    Кэш у каждого процесса свой, и invalidate действует только в воркере, обработавшем запись,
+    поэтому при нескольких воркерах кэш отключается (USER_CACHE_SIZE=0)
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: OrderedDict[int, tuple] = OrderedDict()
+        self.inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(
+        self, tg_uid: int, loader: Callable[[], Awaitable[Optional[bytes]]]
+    ) -> Optional[bytes]:
+        entry = self.data.get(tg_uid)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.data.move_to_end(tg_uid)
+                self.hits += 1
+                return value
+            del self.data[tg_uid]
+        self.misses += 1
+
+        future = self.inflight.get(tg_uid)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[tg_uid] = future
+        try:
+            value = await loader()
+        except BaseException as ex:
+            future.set_exception(ex)
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            # запись могла быть изменена, пока шел запрос: тогда invalidate уже убрал future
+            if value is not None and self.inflight.get(tg_uid) is future:
+                self.put(tg_uid, value)
+            return value
+        finally:
+            if self.inflight.get(tg_uid) is future:
+                del self.inflight[tg_uid]
+
+    def put(self, tg_uid: int, value: bytes) -> None:
+        if self.maxsize <= 0:
+            return
+        self.data[tg_uid] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(tg_uid)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, tg_uid: int) -> None:
+        self.data.pop(tg_uid, None)
+        self.inflight.pop(tg_uid, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
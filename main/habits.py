@@ -0,0 +1,103 @@
+"""
+Двойная запись привычек на время перехода с JSONB-колонок user.habits/user.completed
+на нормализованные таблицы habit и habit_completion. Источником данных для /api/user
+пока остаются JSONB-колонки, таблицы синхронизируются в той же транзакции
+"""
+
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger,
+    Integer,
+    any_,
+    cast,
+    delete,
+    func,
+    literal,
+    null,
+    select,
+    true,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from main.models import Habit, HabitCompletion, User
+
+
+async def sync_user_habits(session: AsyncSession, *tg_uids: int) -> None:
+    """
+    Приведение строк habit пользователей в соответствие с их JSONB-колонками
+    """
+    users = User.tg_uid == any_(literal(list(tg_uids), ARRAY(BigInteger)))
+    completed = func.coalesce(User.completed, cast([], JSONB))
+    habits = func.coalesce(User.habits, cast({}, JSONB))
+
+    # в completed одно имя может встречаться дважды (привычку добавили заново и снова выполнили),
+    # а вставка двух строк с одним ключом ломает ON CONFLICT DO UPDATE. Как в миграции
+    # c3a7f19d2e64, имена берутся через DISTINCT ON, а активные привычки имеют приоритет
+    done = func.jsonb_array_elements_text(completed).table_valued("value").render_derived()
+    stmt = insert(Habit).from_select(
+        ["user_id", "name", "count", "completed_at"],
+        select(
+            User.id,
+            done.c.value,
+            User.repeat_number,
+            func.coalesce(User.date_changed, func.now()),
+        )
+        .distinct(User.id, done.c.value)
+        .select_from(User)
+        .join(done, true())
+        .where(users, ~habits.has_key(done.c.value)),
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            constraint="uq_habit_user_id_name",
+            set_={"completed_at": func.coalesce(Habit.completed_at, stmt.excluded.completed_at)},
+        )
+    )
+
+    active = func.jsonb_each_text(User.habits).table_valued("key", "value").render_derived()
+    stmt = insert(Habit).from_select(
+        ["user_id", "name", "count", "completed_at"],
+        select(User.id, active.c.key, cast(active.c.value, Integer), null())
+        .select_from(User)
+        .join(active, true())
+        .where(users),
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            constraint="uq_habit_user_id_name",
+            set_={"count": stmt.excluded["count"], "completed_at": None},
+        )
+    )
+
+    await session.execute(
+        delete(Habit).where(
+            Habit.user_id == User.id,
+            users,
+            ~habits.has_key(Habit.name),
+            ~completed.has_key(Habit.name),
+        )
+    )
+
+
+async def log_completion(
+    session: AsyncSession, user_id: int, habit: str, count: int, done: bool
+) -> None:
+    """
+    Обновление счетчика привычки и запись выполнения в журнал одним запросом
+    """
+    now = datetime.now()
+    upsert = insert(Habit).values(
+        user_id=user_id, name=habit, count=count, completed_at=now if done else None
+    )
+    upsert = upsert.on_conflict_do_update(
+        constraint="uq_habit_user_id_name",
+        set_={"count": upsert.excluded["count"], "completed_at": upsert.excluded.completed_at},
+    ).returning(Habit.id)
+    habit_row = upsert.cte("habit_row")
+    await session.execute(
+        insert(HabitCompletion).from_select(
+            ["habit_id", "completed_at"], select(habit_row.c.id, func.now())
+        )
+    )
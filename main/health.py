@@ -0,0 +1,139 @@
+"""
+Запуск приложения без блокировки цикла событий: ожидание базы данных с экспоненциальной
+задержкой и случайным разбросом, подготовка схемы и состояние для /health/live и /health/ready
+"""
+
+import asyncio
+import os
+import random
+import time
+from functools import lru_cache
+
+from alembic.script import ScriptDirectory
+from asyncpg.exceptions import CannotConnectNowError
+from dotenv import find_dotenv, load_dotenv
+from loguru import logger
+from sqlalchemy import MetaData, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+load_dotenv(find_dotenv())
+
+# первая задержка между попытками подключения и ее предел в секундах
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF", 0.2))
+DB_CONNECT_BACKOFF_MAX = float(os.getenv("DB_CONNECT_BACKOFF_MAX", 5))
+# время на проверку соединения в /health/ready
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", 2))
+
+ALEMBIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic")
+
+CONNECT_ERRORS = (OSError, CannotConnectNowError, DBAPIError)
+
+
+class HealthState:
+    """
+    Состояние запуска процесса: ready - база доступна и схема подготовлена,
+    draining - процесс завершается и не должен получать новые запросы
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        self.ready = False
+        self.draining = False
+        self.attempts = 0
+        self.error = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready and not self.draining,
+            "draining": self.draining,
+            "attempts": self.attempts,
+            "startup_seconds": round(self.ready_at - self.started_at, 3)
+            if self.ready_at is not None
+            else None,
+            "error": self.error,
+        }
+
+
+@lru_cache
+def alembic_heads() -> frozenset:
+    return frozenset(ScriptDirectory(ALEMBIC_DIR).get_heads())
+
+
+async def applied_revisions(connection: AsyncConnection) -> set:
+    """
+    Ревизии из таблицы alembic_version, пустое множество, если миграции не применялись
+    """
+    exists = await connection.scalar(text("SELECT to_regclass('alembic_version')"))
+    if exists is None:
+        return set()
+    return set(await connection.scalars(text("SELECT version_num FROM alembic_version")))
+
+
+async def prepare_schema(connection: AsyncConnection, metadata: MetaData) -> None:
+    """
+    create_all только для базы, в которой не применена последняя миграция Alembic
+    """
+    heads = alembic_heads()
+    applied = await applied_revisions(connection)
+    if applied == heads:
+        logger.info(f"Схема базы данных на ревизии {', '.join(sorted(heads))}")
+        return
+    if applied:
+        logger.warning(
+            f"Ревизия базы данных {', '.join(sorted(applied))} отстает от миграций "
+            f"{', '.join(sorted(heads))}, выполните alembic upgrade head"
+        )
+    await connection.run_sync(metadata.create_all)
+
+
+async def wait_for_database(
+    engine: AsyncEngine,
+    metadata: MetaData,
+    state: HealthState,
+    backoff: float = DB_CONNECT_BACKOFF,
+    backoff_max: float = DB_CONNECT_BACKOFF_MAX,
+) -> None:
+    """
+    Подключение к базе данных до успеха. Задержка между попытками растет вдвое до backoff_max,
+    а фактическое ожидание выбирается случайно от половины до полной задержки, чтобы
+    одновременно перезапущенные процессы не обращались к базе синхронно
+    """
+    delay = backoff
+    while True:
+        state.attempts += 1
+        try:
+            async with engine.begin() as connection:
+                await prepare_schema(connection, metadata)
+        except CONNECT_ERRORS as ex:
+            state.error = str(ex) or type(ex).__name__
+            wait = random.uniform(delay / 2, delay)
+            logger.info(f"База данных недоступна ({state.error}), повтор через {wait:.2f} с")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, backoff_max)
+            continue
+        state.error = None
+        state.ready = True
+        state.ready_at = time.monotonic()
+        logger.info(
+            f"База данных доступна после {state.attempts} попыток, "
+            f"{state.ready_at - state.started_at:.2f} с от запуска"
+        )
+        return
+
+
+async def check_database(engine: AsyncEngine, timeout: float = DB_READY_TIMEOUT) -> str | None:
+    """
+    Проверочный запрос к базе данных, возвращает текст ошибки или None
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+    except (*CONNECT_ERRORS, TimeoutError) as ex:
+        return str(ex) or type(ex).__name__
+    return None
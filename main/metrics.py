@@ -0,0 +1,209 @@
+"""
+Метрики приложения в текстовом формате Prometheus: счетчики, гистограммы и значения,
+хранящиеся в памяти процесса. Запись метрики - несколько операций со списком без блокировок:
+обработчики запросов и события SQLAlchemy выполняются в потоке цикла событий
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from sqlalchemy import event
+
+# границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry: List["Metric"] = []
+
+
+def label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        registry.append(self)
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in sorted(self.values.items()):
+            yield f"{self.name}{label_text(self.labels, label_values)} {value}"
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Вместо set можно передать функцию, которая вызывается при выдаче метрик
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        collect: Callable[[], Dict[tuple, float]] | None = None,
+    ):
+        super().__init__(name, description, labels)
+        self.values: Dict[tuple, float] = {}
+        self.collect = collect
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values) -> None:
+        self.values[label_values] = value
+
+    def samples(self) -> Iterable[str]:
+        values = self.collect() if self.collect else self.values
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{label_text(self.labels, label_values)} {value}"
+
+
+class Histogram(Metric):
+    """
+    Гистограмма с фиксированными корзинами. Для каждого набора меток хранится список
+    [счетчики корзин..., сумма, количество], наблюдение - поиск корзины делением пополам
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        data = self.values.get(label_values)
+        if data is None:
+            data = self.values[label_values] = [0] * (len(self.buckets) + 3)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        for label_values, data in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data):
+                cumulative += count
+                labels = label_text(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = label_text(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {data[-2]}"
+            yield f"{self.name}_count{labels} {data[-1]}"
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+http_requests = Counter(
+    "http_requests_total", "Количество запросов к API", ("method", "route", "status")
+)
+http_latency = Histogram(
+    "http_request_duration_seconds", "Время обработки запроса к API", ("method", "route")
+)
+http_in_flight = Gauge("http_requests_in_flight", "Запросы к API, обрабатываемые сейчас")
+db_latency = Histogram(
+    "db_query_duration_seconds", "Время выполнения запроса к базе данных", ("statement",)
+)
+db_errors = Counter(
+    "db_query_errors_total", "Запросы к базе данных, завершившиеся ошибкой", ("statement",)
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: количество и время обработки запросов по шаблону маршрута
+    (например, /api/user), а не по фактическому пути, чтобы число меток было ограничено
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.dec()
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            http_latency.observe(elapsed, method, route)
+            http_requests.inc(method, route, str(status))
+
+
+def statement_kind(statement: str) -> str:
+    """
+    Тип запроса по первому слову SQL: SELECT, INSERT, UPDATE, DELETE, WITH и т.д.
+    """
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "EMPTY"
+
+
+def instrument_engine(sync_engine) -> None:
+    """
+    Подписка на события выполнения запросов движка SQLAlchemy для db_query_duration_seconds
+    """
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        db_latency.observe(time.perf_counter() - start, statement_kind(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+        db_errors.inc(statement_kind(exception_context.statement or ""))
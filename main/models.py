@@ -1,7 +1,16 @@
 from datetime import datetime
 from typing import Any, Dict
 
-from sqlalchemy import Column, Integer, BigInteger, DateTime
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    DateTime,
+    ForeignKey,
+    Index,
+    Text,
+    UniqueConstraint,
+)
 from sqlalchemy.dialects.postgresql import JSONB
 
 from main.database import Base
@@ -16,15 +25,54 @@ class User(Base):
     completed = Column(JSONB, default=list())
     repeat_number = Column(Integer, default=21)
     date_changed = Column(DateTime, default=datetime.now())
-    time_zone = Column(Integer, default=0)
+    time_zone = Column(Integer, default=0, index=True)
 
     def __getitem__(self, point):
         return getattr(self, point)
 
     def to_json(self) -> Dict[str, Any]:
-        result_json = {
-            column.name: getattr(self, column.name)
-            for column in self.__table__.columns
-            if column.name != "id"
-        }
+        result_json = {name: getattr(self, name) for name in USER_JSON_COLUMNS}
         return {"user": result_json, "result": True}
+
+
+# колонки ответа /api/user, вычисляются один раз при импорте
+USER_JSON_COLUMNS = tuple(
+    column.name for column in User.__table__.columns if column.name != "id"
+)
+
+
+class Habit(Base):
+    """
+    Привычка пользователя. completed_at пуст, пока привычка прорабатывается
+    """
+
+    __tablename__ = "habit"
+    __table_args__ = (
+        UniqueConstraint("user_id", "name", name="uq_habit_user_id_name"),
+        Index("ix_habit_user_id_completed_at", "user_id", "completed_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+    )
+    name = Column(Text, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    completed_at = Column(DateTime, nullable=True)
+
+
+class HabitCompletion(Base):
+    """
+    Журнал выполнений привычки, по записи на каждое нажатие
+    """
+
+    __tablename__ = "habit_completion"
+    __table_args__ = (
+        Index("ix_habit_completion_habit_id_completed_at", "habit_id", "completed_at"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    habit_id = Column(
+        Integer, ForeignKey("habit.id", ondelete="CASCADE"), nullable=False
+    )
+    completed_at = Column(DateTime, nullable=False, default=datetime.now)
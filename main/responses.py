@@ -0,0 +1,18 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class OrjsonResponse(JSONResponse):
+    """
+    JSON-ответ, сериализуемый orjson. Используется на внутренних маршрутах, где данные
+    формирует само приложение и проверка response_model не нужна
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -36,5 +36,22 @@ class UserPatch(BaseModel):
     time_zone: int | None = Field(None, description="Код часового пояса")
 
 
+class HabitComplete(BaseModel):
+    tg_uid: int = Field(..., description="uid пользователя telegram")
+    habit: str = Field(..., description="Название привычки")
+
+
+class BatchGet(BaseModel):
+    tg_uids: List[int] = Field(
+        ..., max_length=1000, description="Список uid пользователей telegram"
+    )
+
+
+class BatchPatch(BaseModel):
+    users: List[UserPatch] = Field(
+        ..., max_length=1000, description="Список изменений данных пользователей"
+    )
+
+
 class Result(BaseModel):
     result: bool = True
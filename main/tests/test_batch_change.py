@@ -0,0 +1,38 @@
+"""
+Запрос /api/users/batch_change для пакета, в котором часть полей не передана.
+Запуск из корня репозитория: python -m pytest main/tests
+"""
+
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from main.app import batch_patch_statement
+
+PATCH_COLUMNS = ("habits", "completed", "repeat_number", "date_changed", "time_zone")
+
+
+def compiled(rows: list) -> str:
+    return str(batch_patch_statement(rows).compile(dialect=asyncpg.dialect()))
+
+
+def test_missing_fields_are_typed():
+    # во всех строках передан только time_zone, остальные столбцы VALUES - NULL
+    sql = compiled([(1, None, None, None, None, 5), (2, None, None, None, None, 6)])
+    assert "CAST(patch.habits AS JSONB)" in sql
+    assert "CAST(patch.completed AS JSONB)" in sql
+    assert "CAST(patch.repeat_number AS INTEGER)" in sql
+    assert "CAST(patch.date_changed AS TIMESTAMP WITHOUT TIME ZONE)" in sql
+    assert "CAST(patch.time_zone AS INTEGER)" in sql
+
+
+def test_every_column_keeps_current_value_when_missing():
+    sql = compiled(
+        [
+            (1, {"зарядка": 1}, None, None, datetime.now(), None),
+            (2, None, ["бег"], 21, None, 3),
+        ]
+    )
+    for name in PATCH_COLUMNS:
+        assert f'{name}=coalesce(CAST(patch.{name} AS' in sql
+        assert f'"user".{name})' in sql
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import time
+from typing import Iterator
+
+import requests
+from dotenv import load_dotenv, find_dotenv
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
+from urllib3.exceptions import NewConnectionError
+
+from metrics import api_errors, api_latency
+
+load_dotenv(find_dotenv())
+
+# для использования вне контейнера
+# BASE_URL = "http://127.0.0.1:8088/api"
+
+# для использования в контейнере
+BASE_URL = os.getenv("API_URL", "http://api:8088/api")
+
+HEADERS = {"authorization-token": os.getenv("API_TOKEN", "token")}
+
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", 20))
+RETRIES = int(os.getenv("API_RETRIES", 3))
+BACKOFF = float(os.getenv("API_BACKOFF", 0.3))
+SLOW_CALL_MS = float(os.getenv("API_SLOW_CALL_MS", 500))
+TIMEOUT = (3, 3)
+
+logger = logging.getLogger("api_client")
+
+
+def not_sent(ex: Exception) -> bool:
+    """
+    Ошибка при установке соединения: запрос до FastApi не дошел, и его можно повторить,
+    даже если он не идемпотентный
+    """
+    if isinstance(ex, ConnectTimeout):
+        return True
+    reason = getattr(ex.args[0], "reason", None) if ex.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class ApiClient:
+    """
+    Клиент FastApi с общим пулом keep-alive соединений.
+    Запросы повторяются с экспоненциальной задержкой при ConnectionError/ReadTimeout,
+    неидемпотентные (idempotent=False) - только если соединение не удалось установить.
+    Длительность каждого запроса пишется в лог
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        pool_size: int = POOL_SIZE,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        timeout: tuple = TIMEOUT,
+    ):
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.headers["Connection"] = "keep-alive"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latency = {}
+
+    def request(
+        self, method: str, endpoint: str, idempotent: bool = True, **kwargs
+    ) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        url = f"{self.base_url}/{endpoint}"
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, ReadTimeout) as ex:
+                api_errors.inc(endpoint, type(ex).__name__)
+                if attempt >= self.retries or not (idempotent or not_sent(ex)):
+                    raise
+                delay = self.backoff * 2**attempt
+                attempt += 1
+                logger.warning(
+                    f"{method} /{endpoint}: {type(ex).__name__}, повтор {attempt} через {delay:.2f} с"
+                )
+                time.sleep(delay)
+                continue
+            self.report(method, endpoint, response.status_code, time.perf_counter() - start)
+            return response
+
+    def report(self, method: str, endpoint: str, status: int, elapsed: float) -> None:
+        """
+        Учет длительности запроса: количество, суммарное и максимальное время по эндпоинту
+        """
+        api_latency.observe(elapsed, endpoint, str(status))
+        elapsed_ms = elapsed * 1000
+        count, total, maximum = self.latency.get(endpoint, (0, 0.0, 0.0))
+        self.latency[endpoint] = (count + 1, total + elapsed_ms, max(maximum, elapsed_ms))
+        log = logger.warning if elapsed_ms > SLOW_CALL_MS else logger.debug
+        log(f"{method} /{endpoint} {status} {elapsed_ms:.1f} мс")
+
+    def stats(self) -> dict:
+        return {
+            endpoint: {"count": count, "avg_ms": total / count, "max_ms": maximum}
+            for endpoint, (count, total, maximum) in self.latency.items()
+        }
+
+    def get_user(self, user_id) -> dict:
+        return self.request("GET", "user", headers={"tg-uid": f"{user_id}"}).json()
+
+    def get_users(self, attrib: str) -> dict:
+        return self.request("GET", "get_users", headers={"attrib": attrib}).json()
+
+    def iter_users(self, attrib: str) -> Iterator[dict]:
+        """
+        Потоковое чтение пользователей из /get_users/stream построчно, без загрузки всего списка в память
+        """
+        response = self.request(
+            "GET", "get_users/stream", headers={"attrib": attrib}, stream=True
+        )
+        with response:
+            if not response.headers.get("content-type", "").startswith("application/x-ndjson"):
+                raise ValueError(response.json())
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def get_due_users(self, utc_hour: int, page_size: int = 10000) -> list:
+        """
+        tg_uid пользователей, у которых в utc_hour наступает время уведомления, постранично
+        """
+        uids, cursor = [], 0
+        while True:
+            result = self.request(
+                "GET",
+                "due_users",
+                headers={"utc-hour": f"{utc_hour}", "limit": f"{page_size}", "after-id": f"{cursor}"},
+            ).json()
+            if not result["result"]:
+                raise ValueError(result)
+            uids.extend(result["users"])
+            cursor = result["next_cursor"]
+            if cursor is None:
+                return uids
+
+    def make_user(self, data: dict) -> dict:
+        # повтор после таймаута чтения вернул бы IntegrityError для уже созданного пользователя
+        return self.request("POST", "make_user", idempotent=False, json=data).json()
+
+    def patch_user(self, data: dict) -> dict:
+        return self.request("PATCH", "change_user", json=data).json()
+
+    def complete_habit(self, user_id, habit: str) -> dict:
+        # повтор после таймаута чтения увеличил бы счетчик привычки второй раз
+        return self.request(
+            "PATCH",
+            "complete_habit",
+            idempotent=False,
+            json={"tg_uid": user_id, "habit": habit},
+        ).json()
+
+    def batch_get_users(self, user_ids: list) -> dict:
+        return self.request("POST", "users/batch_get", json={"tg_uids": list(user_ids)}).json()
+
+    def batch_patch_users(self, patches: list) -> dict:
+        return self.request("PATCH", "users/batch_change", json={"users": patches}).json()
+
+    def delete_user(self, user_id) -> dict:
+        return self.request("DELETE", "delete_user", headers={"tg-uid": f"{user_id}"}).json()
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator
+
+import aiohttp
+
+from api_client import BASE_URL, HEADERS, POOL_SIZE, RETRIES, BACKOFF, SLOW_CALL_MS
+
+logger = logging.getLogger("api_client")
+
+# ошибки установки соединения: запрос не отправлен, повтор безопасен для любого метода
+NOT_SENT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+
+class AsyncApiClient:
+    """
+    Асинхронный клиент FastApi на aiohttp. Сессия с пулом keep-alive соединений создается
+    при первом запросе внутри запущенного event loop. Неидемпотентные запросы
+    (idempotent=False) повторяются только при ошибках установки соединения
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        pool_size: int = POOL_SIZE,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        timeout: float = 6,
+    ):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=3)
+        self.session: aiohttp.ClientSession | None = None
+        self.latency = {}
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=HEADERS,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+            )
+        return self.session
+
+    async def request(
+        self, method: str, endpoint: str, idempotent: bool = True, **kwargs
+    ) -> dict:
+        url = f"{self.base_url}/{endpoint}"
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with self.get_session().request(method, url, **kwargs) as response:
+                    result = await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                if attempt >= self.retries or not (idempotent or isinstance(ex, NOT_SENT_ERRORS)):
+                    raise
+                delay = self.backoff * 2**attempt
+                attempt += 1
+                logger.warning(
+                    f"{method} /{endpoint}: {type(ex).__name__}, повтор {attempt} через {delay:.2f} с"
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.report(method, endpoint, response.status, time.perf_counter() - start)
+            return result
+
+    def report(self, method: str, endpoint: str, status: int, elapsed: float) -> None:
+        elapsed_ms = elapsed * 1000
+        count, total, maximum = self.latency.get(endpoint, (0, 0.0, 0.0))
+        self.latency[endpoint] = (count + 1, total + elapsed_ms, max(maximum, elapsed_ms))
+        log = logger.warning if elapsed_ms > SLOW_CALL_MS else logger.debug
+        log(f"{method} /{endpoint} {status} {elapsed_ms:.1f} мс")
+
+    async def get_user(self, user_id) -> dict:
+        return await self.request("GET", "user", headers={"tg-uid": f"{user_id}"})
+
+    async def get_users(self, attrib: str) -> dict:
+        return await self.request("GET", "get_users", headers={"attrib": attrib})
+
+    async def iter_users(self, attrib: str) -> AsyncIterator[dict]:
+        """
+        Потоковое чтение пользователей из /get_users/stream построчно
+        """
+        url = f"{self.base_url}/get_users/stream"
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.timeout.total)
+        async with self.get_session().get(url, headers={"attrib": attrib}, timeout=timeout) as response:
+            if response.content_type != "application/x-ndjson":
+                raise ValueError(await response.json())
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def make_user(self, data: dict) -> dict:
+        return await self.request("POST", "make_user", idempotent=False, json=data)
+
+    async def patch_user(self, data: dict) -> dict:
+        return await self.request("PATCH", "change_user", json=data)
+
+    async def complete_habit(self, user_id, habit: str) -> dict:
+        return await self.request(
+            "PATCH",
+            "complete_habit",
+            idempotent=False,
+            json={"tg_uid": user_id, "habit": habit},
+        )
+
+    async def delete_user(self, user_id) -> dict:
+        return await self.request("DELETE", "delete_user", headers={"tg-uid": f"{user_id}"})
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
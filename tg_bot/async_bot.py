@@ -0,0 +1,373 @@
+"""
+Асинхронный режим бота на AsyncTeleBot. Обработчики и запросы к FastApi выполняются корутинами,
+поэтому медленный ответ API не занимает поток. Запуск: python async_bot.py
+"""
+
+import asyncio
+import logging
+import os
+from array import array
+
+import aiohttp
+from dotenv import load_dotenv, find_dotenv
+
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_filters import StateFilter
+from telebot.asyncio_storage import StateMemoryStorage
+from telebot.states import State, StatesGroup
+
+from async_api_client import AsyncApiClient
+from async_dispatcher import AsyncReminderDispatcher
+from chat_state import ChatStateStore
+from reminders import ReminderEngine
+from messages import (
+    help,
+    menu,
+    start,
+    empty_list,
+    no_account,
+    something_went_wrong,
+    congratulations,
+    greetings,
+    commands,
+    TIMEZONES,
+)
+
+load_dotenv(find_dotenv())
+
+TOKEN = os.getenv("TOKEN")
+
+bot = AsyncTeleBot(TOKEN, state_storage=StateMemoryStorage())
+bot.add_custom_filter(StateFilter(bot))
+
+api = AsyncApiClient()
+reminders = ReminderEngine()
+dispatcher = AsyncReminderDispatcher(bot)
+chat_states = ChatStateStore()
+
+logging.basicConfig(
+    level=20,
+    format="%(asctime)s || %(name)s || %(levelname)s || %(message)s || %(module)s.%(funcName)s:%(lineno)d",
+)
+logger = logging.getLogger("main_logger")
+
+
+class Steps(StatesGroup):
+    """
+    Шаги диалога, заменяющие register_next_step_handler синхронного бота
+    """
+
+    add_habit = State()
+    set_repeat_number = State()
+    delete_account = State()
+
+
+@bot.message_handler(state=Steps.add_habit)
+async def add_habit(message: types.Message) -> None:
+    text = message.text.lstrip("/")
+    if len(text) > 40:
+        await bot.send_message(
+            message.chat.id,
+            "В описании привычки должно быть не более 40 символов. Попробуйте еще раз.",
+        )
+        return
+    user_id = message.from_user.id
+    async with bot.retrieve_data(user_id, message.chat.id) as data:
+        habits = data["habits"]
+    await bot.delete_state(user_id, message.chat.id)
+    result = await api.patch_user({"tg_uid": user_id, "habits": habits | {text: 0}})
+    if result["result"]:
+        habits = (await api.get_user(user_id))["user"]["habits"]
+        await bot.send_message(message.chat.id, f"Привычка '{text}' добавлена!")
+        if habits:
+            await list_habits(message, habits)
+        else:
+            await bot.send_message(message.chat.id, empty_list)
+    else:
+        await error_message(message, something_went_wrong)
+
+
+@bot.message_handler(state=Steps.set_repeat_number)
+async def set_repeat_number(message: types.Message) -> None:
+    text = message.text
+    user_id = message.from_user.id
+    if text.isdigit() and 10 <= int(text) <= 50:
+        await bot.delete_state(user_id, message.chat.id)
+        await api.patch_user({"tg_uid": user_id, "repeat_number": text})
+        await bot.send_message(
+            user_id,
+            f"Ваше число повторений привычки для проработки: {text}. Список привычек - /get_habits",
+        )
+    else:
+        await bot.send_message(user_id, "Ошибка ввода данных. Нужно ввести число от 10 до 50")
+
+
+@bot.message_handler(state=Steps.delete_account)
+async def delete_account(message: types.Message) -> None:
+    user_id = message.from_user.id
+    await bot.delete_state(user_id, message.chat.id)
+    if message.text == "да":
+        result = await api.delete_user(user_id)
+        if result:
+            reminders.remove(user_id)
+            await bot.send_message(
+                user_id,
+                "Ваша учетная запись удалена. Но вы всегда можете создать новую, с новыми привычками :)."
+                " Для регистрации укажите ваш часовой пояс - /time_zone",
+            )
+        else:
+            await error_message(message, something_went_wrong)
+    else:
+        await error_message(
+            message,
+            "Неверное контрольное слово для удаления учетной записи. Может, и не стоит? Кстати, что там у нас с привычками... /get_habits, /menu",
+        )
+
+
+@bot.message_handler(commands=commands)
+async def get_text_commands(message: types.Message) -> None:
+    command = message.text[1:]
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    try:
+        if command == "start":
+            result = await api.get_user(user_id)
+            if not result["result"]:
+                await bot.send_message(
+                    user_id, f"Привет, {message.from_user.full_name}! {start}"
+                )
+            else:
+                await bot.send_message(
+                    user_id,
+                    f"С возвращением, {message.from_user.full_name}! Проработаем привычки? :) - /get_habits",
+                )
+        elif command == "help":
+            await bot.send_message(user_id, f"{help}")
+        elif command == "menu":
+            await bot.send_message(user_id, menu)
+        elif command == "time_zone":
+            markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+            for tz in TIMEZONES:
+                markup.add(tz)
+            await bot.send_message(chat_id, "Выберите ваш часовой пояс:", reply_markup=markup)
+        elif command in ("get_habits", "delete_habit"):
+            result = await api.get_user(user_id)
+            if result["result"]:
+                habits = result["user"]["habits"]
+                completed = result["user"]["completed"]
+                if habits:
+                    await list_habits(message, habits, command == "delete_habit")
+                elif not completed:
+                    await bot.send_message(chat_id, empty_list)
+                else:
+                    await bot.send_message(
+                        chat_id,
+                        f"Список привычек пуст, но, вижу, есть уже выученные: *{", ".join(completed)}*. "
+                        rf"Не будем останавливаться на достигнутом и разучим новую? /add\_habit",
+                        parse_mode="Markdown",
+                    )
+            else:
+                await error_message(message, no_account)
+        elif command == "add_habit":
+            result = await api.get_user(user_id)
+            if result["result"]:
+                # шаг сохраняется до ответа, иначе быстрый ответ пользователя придет без состояния
+                await bot.set_state(user_id, Steps.add_habit, chat_id)
+                await bot.add_data(user_id, chat_id, habits=result["user"]["habits"])
+                await bot.send_message(chat_id, "Опишите привычку, которую хотите выучить. /menu")
+            else:
+                await error_message(message, no_account)
+        elif command == "run_scheduler":
+            await load_reminders()
+        elif command == "stop_scheduler":
+            reminders.load(())
+        elif command == "get_completed":
+            result = await api.get_user(user_id)
+            if result["result"]:
+                completed = result["user"]["completed"]
+                if completed:
+                    await bot.send_message(
+                        user_id,
+                        f"Вот все ваши проработанные привычки: \n*{", ".join(completed)}*. \n/menu",
+                        parse_mode="Markdown",
+                    )
+                else:
+                    await bot.send_message(
+                        user_id,
+                        "Вы еще не проработали ни одной привычки. Список привычек - /get_habits",
+                    )
+            else:
+                await error_message(message, no_account)
+        elif command == "set_repeat_number":
+            result = await api.get_user(user_id)
+            if result["result"]:
+                repeat_number = result["user"]["repeat_number"]
+                await bot.set_state(user_id, Steps.set_repeat_number, chat_id)
+                await bot.send_message(
+                    user_id,
+                    f"Для изменения числа повторения привычки введите число от 10 до 50. Текущее значение: {repeat_number}",
+                )
+            else:
+                await error_message(message, no_account)
+        elif command == "delete_account":
+            result = await api.get_user(user_id)
+            if result["result"]:
+                await bot.set_state(user_id, Steps.delete_account, chat_id)
+                await bot.send_message(
+                    user_id,
+                    "Если вы хотите удалить свою учетную запись без возможнсти восстановления данных - введите слово 'да'",
+                )
+            else:
+                await error_message(
+                    message,
+                    "У вас пока нет учетной записи, поэтому удалять нечего. Для регистрации укажите ваш часовой пояс - /time_zone",
+                )
+    except aiohttp.ClientConnectionError as ex:
+        logger.error(ex)
+        await error_message(message, something_went_wrong)
+
+
+@bot.message_handler(
+    func=lambda message: chat_states.has_button(message.chat.id, message.text)
+)
+async def habit_selected(message: types.Message) -> None:
+    """
+    Функция выбора привычки для проработки/удаления
+    """
+    state = chat_states.pop(message.chat.id)
+    user_id = message.from_user.id
+    if state is not None and state.delete_mode:
+        result = await api.get_user(user_id)
+        habit = message.text
+        result["user"]["habits"].pop(habit)
+        await api.patch_user({"habits": result["user"]["habits"], "tg_uid": user_id})
+        text = f"Привычка '{habit}' удалена. /get_habits, /menu"
+        habits = (await api.get_user(user_id))["user"]["habits"]
+    else:
+        habit = " ".join(message.text.split()[:-1])
+        result = await api.complete_habit(user_id, habit)
+        if not result["result"]:
+            await error_message(message, something_went_wrong)
+            return
+        if result["done"]:
+            text = f"Поздравляем, вы проработали привычку '{habit}'!"
+        else:
+            text = f"Привычка '{habit}' выполнена. Осталось еще {result["repeat_number"] - result["count"]}"
+        habits = result["habits"]
+    await bot.send_message(message.chat.id, text)
+    await list_habits(message, habits)
+
+
+@bot.message_handler(func=lambda message: message.text in TIMEZONES)
+async def timezone_selected(message: types.Message) -> None:
+    """
+    Функция выбора/изменения часового пояса и регистрации нового пользователя
+    """
+    user_timezone = message.text
+    time_zone = user_timezone.split("+")[-1]
+    user_id = message.from_user.id
+    try:
+        result = await api.get_user(user_id)
+        data = {"time_zone": f"{time_zone}", "tg_uid": f"{user_id}"}
+        if result["result"]:
+            result = await api.patch_user(data)
+            if result["result"]:
+                reminders.update(user_id, int(time_zone))
+                await bot.send_message(
+                    message.chat.id, f"Ваш часовой пояс установлен: {user_timezone} /menu"
+                )
+            else:
+                await error_message(message, something_went_wrong)
+        else:
+            result = await api.make_user(data)
+            if result["result"]:
+                reminders.add(user_id, int(time_zone))
+                await bot.send_message(message.chat.id, congratulations)
+            else:
+                await error_message(message, something_went_wrong)
+    except aiohttp.ClientConnectionError as ex:
+        logger.exception(ex)
+        await error_message(message, something_went_wrong)
+
+
+@bot.message_handler(content_types=["text"])
+async def get_text_messages(message: types.Message) -> None:
+    """Функция интерактивного диалога с пользователем в режиме реакции на любой текст."""
+    if message.text.lower() in greetings:
+        await bot.send_message(
+            message.from_user.id,
+            f"{message.from_user.full_name}, и вам здравствуйте. Какую привычку сегодня вам угодно проработать? :) - /get_habits",
+        )
+    else:
+        await bot.send_message(
+            message.from_user.id,
+            f"{message.from_user.full_name}, пожалуйста, выберите команду из /menu",
+        )
+
+
+async def list_habits(message: types.Message, habits: dict, delete_habit: bool = False) -> None:
+    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+    buttons = []
+    for key in habits:
+        habit = f"{key} {habits.get(key)}" if not delete_habit else key
+        buttons.append(habit)
+        markup.add(habit)
+    chat_states.set_buttons(message.chat.id, buttons, delete_habit)
+    text = (
+        "Вот ваш список привычек для проработки. Нажмите на кнопку с привычкой чтобы отметить ее выполнение. \n/menu"
+        if not delete_habit
+        else "Выберите привычку, которую хотите удалить. /menu"
+    )
+    await bot.send_message(message.chat.id, text, reply_markup=markup)
+
+
+async def error_message(message: types.Message, text: str) -> None:
+    await bot.send_message(message.chat.id, f"{text}")
+
+
+def message_reminder(uids) -> None:
+    dispatcher.submit_many(uids, "Не забывайте прорабатывать привычки ;) - /get_habits")
+
+
+async def load_reminders() -> None:
+    """
+    Загрузка расписания уведомлений пользователям с учетом их временных зон
+    """
+    reminders.begin_load()
+    while True:
+        uids, time_zones = array("q"), array("q")
+        try:
+            async for attrib in api.iter_users("tg_uid time_zone"):
+                uids.append(attrib["tg_uid"])
+                time_zones.append(attrib["time_zone"] or 0)
+            break
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+            logger.error(f"Не удалось загрузить пользователей, {ex}")
+        await asyncio.sleep(1)
+    reminders.load(zip(uids, time_zones))
+
+
+async def scheduler() -> None:
+    await load_reminders()
+    while True:
+        for uids in reminders.pop_due():
+            message_reminder(uids)
+        await asyncio.sleep(1)
+
+
+async def main() -> None:
+    logger.info("Запуск бота в асинхронном режиме")
+    dispatcher.start()
+    reminder_task = asyncio.create_task(scheduler())
+    try:
+        await bot.infinity_polling()
+    finally:
+        reminder_task.cancel()
+        await dispatcher.stop()
+        await api.close()
+        await bot.close_session()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
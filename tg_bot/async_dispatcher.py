@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from dispatcher import SEND_RATE, SEND_WORKERS, SEND_RETRIES, BULK_CHUNK
+
+logger = logging.getLogger("dispatcher")
+
+
+class AsyncReminderDispatcher:
+    """
+    Рассылка уведомлений асинхронного бота: SEND_WORKERS корутин забирают срезы uid из очереди
+    и отправляют не чаще rate сообщений в секунду. Ответ 429 приостанавливает всех отправителей
+    на retry_after секунд
+    """
+
+    def __init__(self, bot: AsyncTeleBot, workers: int = SEND_WORKERS, rate: float = SEND_RATE):
+        self.bot = bot
+        self.workers = workers
+        self.interval = 1 / rate
+        self.next_send = 0.0
+        self.lock = asyncio.Lock()
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.sent = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self.tasks:
+            return
+        self.tasks = [
+            asyncio.create_task(self._worker(), name=f"sender-{number}")
+            for number in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit_many(self, chat_ids, text: str) -> None:
+        for start in range(0, len(chat_ids), BULK_CHUNK):
+            self.queue.put_nowait((chat_ids[start : start + BULK_CHUNK], text))
+
+    async def _acquire(self) -> None:
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            # пауза после 429 могла начаться, пока мы ждали
+            while (wait := self.next_send - loop.time()) > 0:
+                await asyncio.sleep(wait)
+            self.next_send = max(self.next_send, loop.time()) + self.interval
+
+    def pause(self, seconds: float) -> None:
+        self.next_send = max(self.next_send, asyncio.get_running_loop().time() + seconds)
+
+    async def _send(self, chat_id: int, text: str) -> None:
+        for attempt in range(SEND_RETRIES + 1):
+            await self._acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+            except ApiTelegramException as ex:
+                if ex.error_code != 429 or attempt == SEND_RETRIES:
+                    raise
+                retry_after = ex.result_json.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Превышен лимит отправки, пауза {retry_after} с")
+                self.pause(retry_after)
+                continue
+            self.sent += 1
+            return
+
+    async def _worker(self) -> None:
+        while True:
+            chat_ids, text = await self.queue.get()
+            for chat_id in chat_ids:
+                try:
+                    await self._send(chat_id, text)
+                except Exception as ex:
+                    self.failed += 1
+                    logger.error(f"Не удалось отправить сообщение {chat_id}: {ex}")
+            self.queue.task_done()
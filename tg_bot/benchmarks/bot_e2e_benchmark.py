@@ -0,0 +1,398 @@
+"""
+Сквозной бенчмарк бота без обращения к настоящему Telegram: bot.py запускается в этом же
+процессе в режиме polling и подключается к локальному фейковому Telegram Bot API
+(getUpdates/sendMessage) и к локальной замене FastApi с данными в памяти.
+
+Каждый смоделированный пользователь проходит сценарий: /get_habits, нажатие кнопки привычки,
+/add_habit и ввод новой привычки. Следующее сообщение пользователь отправляет, как только
+получил все ответы на предыдущее. Замеряется время от появления сообщения в getUpdates
+до последнего ответа бота, пропускная способность, число потоков и очередь дорожек обработки.
+
+Запуск из корня репозитория:
+    python tg_bot/benchmarks/bot_e2e_benchmark.py --users 2000 --concurrency 200 --rounds 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "1:bench"
+
+# сообщение пользователя и количество ответов бота на него
+SCENARIO = (("get_habits", 1), ("press_habit", 2), ("add_habit", 1), ("new_habit", 2))
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(len(values) * q / 100 + 0.5) - 1))
+    return values[index]
+
+
+class JsonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело ответа пишутся отдельно, без TCP_NODELAY keep-alive соединение
+    # ждет подтверждения ~40 мс на каждый запрос
+    disable_nagle_algorithm = True
+
+    def reply(self, status: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeApi:
+    """
+    Замена FastApi: эндпоинты, которые вызывает бот, с пользователями в словаре
+    """
+
+    def __init__(self, users: int, habits: int, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.users = {
+            uid: {
+                "tg_uid": uid,
+                "habits": {f"привычка {number}": 0 for number in range(habits)},
+                "completed": [],
+                "repeat_number": 21,
+                "date_changed": "2026-01-01T00:00:00",
+                "time_zone": 3,
+            }
+            for uid in range(1, users + 1)
+        }
+
+    def handle(self, method: str, path: str, headers, body: dict) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            if path == "user":
+                user = self.users.get(int(headers["tg-uid"]))
+                return {"result": True, "user": json.loads(json.dumps(user))} if user else {
+                    "result": False
+                }
+            if path == "change_user":
+                user = self.users.get(int(body["tg_uid"]))
+                if user is None:
+                    return {"result": False}
+                user.update({key: value for key, value in body.items() if value is not None})
+                return {"result": True}
+            if path == "make_user":
+                user = self.users[int(body["tg_uid"])] = {
+                    "tg_uid": int(body["tg_uid"]),
+                    "habits": {},
+                    "completed": [],
+                    "repeat_number": 21,
+                    "date_changed": "2026-01-01T00:00:00",
+                    "time_zone": int(body.get("time_zone") or 0),
+                }
+                return {"result": True, "user": json.loads(json.dumps(user))}
+            if path == "complete_habit":
+                user = self.users.get(int(body["tg_uid"]))
+                habit = body["habit"]
+                if user is None or habit not in user["habits"]:
+                    return {"result": False}
+                count = user["habits"][habit] + 1
+                done = count >= user["repeat_number"]
+                if done:
+                    user["habits"].pop(habit)
+                    user["completed"].append(habit)
+                else:
+                    user["habits"][habit] = count
+                return {
+                    "result": True,
+                    "done": done,
+                    "count": count,
+                    "habits": dict(user["habits"]),
+                    "completed": list(user["completed"]),
+                    "repeat_number": user["repeat_number"],
+                }
+            if path == "delete_user":
+                return {"result": self.users.pop(int(headers["tg-uid"]), None) is not None}
+        return {"result": False}
+
+    def serve(self) -> JsonServer:
+        api = self
+
+        class Handler(JsonHandler):
+            def dispatch(self):
+                path = urlsplit(self.path).path.removeprefix("/api/")
+                self.reply(200, api.handle(self.command, path, self.headers, self.read_json()))
+
+            do_GET = do_POST = do_PATCH = do_DELETE = dispatch
+
+        return start(JsonServer(("127.0.0.1", 0), Handler))
+
+
+class SimulatedUser:
+    __slots__ = ("uid", "step", "round", "remaining", "sent_at", "buttons")
+
+    def __init__(self, uid: int):
+        self.uid = uid
+        self.step = 0
+        self.round = 0
+        self.remaining = 0
+        self.sent_at = 0.0
+        self.buttons = []
+
+
+class FakeTelegram:
+    """
+    Фейковый Bot API: getUpdates отдает накопленные сообщения пользователей (с длинным
+    опросом), sendMessage засчитывает ответ пользователю и запускает его следующий шаг
+    """
+
+    def __init__(self, users: int, concurrency: int, rounds: int):
+        self.rounds = rounds
+        self.waiting = deque(SimulatedUser(uid) for uid in range(1, users + 1))
+        self.users = {}
+        self.updates = deque()
+        self.cond = threading.Condition()
+        self.update_id = 0
+        self.message_id = 0
+        self.latencies = {name: [] for name, _ in SCENARIO}
+        self.finished = 0
+        self.total = users
+        self.done = threading.Event()
+        self.started = None
+        self.concurrency = concurrency
+
+    def begin(self) -> None:
+        with self.cond:
+            self.started = time.perf_counter()
+            for _ in range(min(self.concurrency, len(self.waiting))):
+                self._activate()
+
+    def _activate(self) -> None:
+        user = self.waiting.popleft()
+        self.users[user.uid] = user
+        self._next_message(user)
+
+    def _next_message(self, user: SimulatedUser) -> None:
+        name, replies = SCENARIO[user.step]
+        if name == "get_habits":
+            text = "/get_habits"
+        elif name == "press_habit":
+            text = user.buttons[0] if user.buttons else "/get_habits"
+        elif name == "add_habit":
+            text = "/add_habit"
+        else:
+            text = f"новая {user.uid} {user.round}"
+        user.remaining = replies
+        user.sent_at = time.perf_counter()
+        self.update_id += 1
+        message = {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": {"id": user.uid, "type": "private"},
+            "from": {"id": user.uid, "is_bot": False, "first_name": "user"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        self.updates.append({"update_id": self.update_id, "message": message})
+        self.cond.notify_all()
+
+    def get_updates(self, params: dict) -> list:
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+        limit = int(params.get("limit") or 100)
+        with self.cond:
+            if not self.updates:
+                self.cond.wait(timeout)
+            return [self.updates.popleft() for _ in range(min(limit, len(self.updates)))]
+
+    def send_message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        with self.cond:
+            self.message_id += 1
+            message_id = self.message_id
+            user = self.users.get(chat_id)
+            if user is not None and user.remaining:
+                if markup and "keyboard" in markup:
+                    user.buttons = [
+                        button["text"] if isinstance(button, dict) else button
+                        for row in markup["keyboard"]
+                        for button in row
+                    ]
+                user.remaining -= 1
+                if not user.remaining:
+                    self._complete_step(user)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def _complete_step(self, user: SimulatedUser) -> None:
+        name, _ = SCENARIO[user.step]
+        self.latencies[name].append(time.perf_counter() - user.sent_at)
+        user.step += 1
+        if user.step == len(SCENARIO):
+            user.step = 0
+            user.round += 1
+        if user.round < self.rounds:
+            self._next_message(user)
+            return
+        del self.users[user.uid]
+        self.finished += 1
+        if self.waiting:
+            self._activate()
+        elif self.finished == self.total:
+            self.done.set()
+
+    def serve(self) -> JsonServer:
+        telegram = self
+
+        class Handler(JsonHandler):
+            def dispatch(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    params.update(parse_qsl(self.rfile.read(length).decode()))
+                method = url.path.rsplit("/", 1)[-1]
+                if method == "getUpdates":
+                    result = telegram.get_updates(params)
+                elif method == "sendMessage":
+                    result = telegram.send_message(params)
+                elif method == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+                else:
+                    result = True
+                self.reply(200, {"ok": True, "result": result})
+
+            do_GET = do_POST = dispatch
+
+        return start(JsonServer(("127.0.0.1", 0), Handler))
+
+
+def start(server: JsonServer) -> JsonServer:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def sample_threads(bot_module, stop: threading.Event, samples: dict) -> None:
+    while not stop.wait(0.05):
+        samples["threads_max"] = max(samples["threads_max"], threading.active_count())
+        lanes = bot_module.bot.lanes.stats()
+        samples["lane_queue_max"] = max(samples["lane_queue_max"], lanes["busiest"])
+        samples["queued_max"] = max(samples["queued_max"], lanes["queued"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк бота")
+    parser.add_argument("--users", type=int, default=1000, help="смоделированных пользователей")
+    parser.add_argument("--concurrency", type=int, default=100, help="активных одновременно")
+    parser.add_argument("--rounds", type=int, default=1, help="повторов сценария на пользователя")
+    parser.add_argument("--habits", type=int, default=5, help="привычек у пользователя")
+    parser.add_argument("--lanes", type=int, default=8, help="дорожек обработки бота")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="задержка ответа API")
+    parser.add_argument("--send-rate", type=float, default=1e6, help="SEND_RATE бота, сообщ./с")
+    parser.add_argument("--timeout", type=float, default=600, help="предельное время прогона, с")
+    parser.add_argument("--output", help="файл для результата в формате JSON")
+    args = parser.parse_args()
+
+    api = FakeApi(args.users, args.habits, args.api_latency_ms / 1000)
+    telegram = FakeTelegram(args.users, args.concurrency, args.rounds)
+    api_server = api.serve()
+    telegram_server = telegram.serve()
+
+    # настройки бота читаются при импорте модулей
+    os.environ.update(
+        TOKEN=TOKEN,
+        API_URL=f"http://127.0.0.1:{api_server.server_port}/api",
+        SEND_RATE=str(args.send_rate),
+        METRICS_PORT="0",
+        BOT_LANES=str(args.lanes),
+    )
+    sys.path.insert(0, BOT_DIR)
+    import bot as bot_module
+    from telebot import apihelper
+
+    apihelper.API_URL = f"http://127.0.0.1:{telegram_server.server_port}/bot{{0}}/{{1}}"
+    bot_module.bot.lanes.start()
+    bot_module.dispatcher.start()
+
+    threads_before = threading.active_count()
+    samples = {"threads_max": threads_before, "lane_queue_max": 0, "queued_max": 0}
+    stop_sampling = threading.Event()
+    threading.Thread(
+        target=sample_threads, args=(bot_module, stop_sampling, samples), daemon=True
+    ).start()
+    polling = threading.Thread(
+        target=bot_module.bot.polling,
+        kwargs={"non_stop": True, "interval": 0, "timeout": 5, "long_polling_timeout": 1},
+        daemon=True,
+    )
+
+    cpu_start = time.process_time()
+    telegram.begin()
+    polling.start()
+    deadline = time.perf_counter() + args.timeout
+    while not telegram.done.wait(0.5):
+        if not polling.is_alive() or time.perf_counter() > deadline:
+            break
+    completed = telegram.done.is_set()
+    elapsed = time.perf_counter() - telegram.started
+    cpu = time.process_time() - cpu_start
+    stop_sampling.set()
+    bot_module.bot.stop_polling()
+
+    steps = sum(len(values) for values in telegram.latencies.values())
+    report = {
+        "benchmark": "bot_e2e",
+        "config": vars(args),
+        "completed": completed,
+        "elapsed": round(elapsed, 2),
+        "steps": steps,
+        "steps_per_second": round(steps / elapsed, 1),
+        "messages_sent": telegram.message_id,
+        "api_calls": api.calls,
+        "cpu_seconds": round(cpu, 2),
+        "threads_before": threads_before,
+        "threads_max": samples["threads_max"],
+        "lane_queue_max": samples["lane_queue_max"],
+        "queued_max": samples["queued_max"],
+        "latency": {},
+    }
+    for name, values in telegram.latencies.items():
+        values.sort()
+        report["latency"][name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Бенчмарк расписания уведомлений на 10k-1M пользователей. Пары (tg_uid, time_zone) отдает
+заглушка ApiClient.iter_users, загрузка повторяет подготовку расписания в scheduler() из bot.py.
+
+Для каждого размера в отдельном процессе замеряются:
+- время загрузки расписания (setup) и процессорное время;
+- память: пик и остаток по tracemalloc после загрузки, пиковый RSS процесса;
+- процессорное время прохода планировщика, когда ничего не наступило (idle tick),
+  и прохода, в котором наступает слот уведомлений (due tick);
+- смещение фактической выдачи уведомлений от назначенного времени в цикле с шагом 1 с.
+
+С флагом --legacy для сравнения замеряется прежняя реализация на библиотеке schedule
+(две задачи schedule.every().day.at(...) на пользователя и schedule.run_pending() раз в секунду).
+Она медленная, поэтому выполняется только для размеров не больше --legacy-max.
+
+Запуск из корня репозитория:
+    python tg_bot/benchmarks/scheduler_benchmark.py --sizes 10000 100000 1000000 --legacy
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BOT_DIR)
+
+from reminders import DAY, ReminderEngine  # noqa: E402
+
+IDLE_TICKS = 1000
+# через сколько секунд после загрузки наступает слот для замера смещения
+DRIFT_DELAY = 2
+
+
+class StubApi:
+    """
+    Заглушка ApiClient: пользователи генерируются по мере чтения, как строки NDJSON-потока
+    """
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.seed = seed
+
+    def iter_users(self, attrib: str):
+        rnd = random.Random(self.seed)
+        for number in range(self.size):
+            # взаимно однозначное перемешивание, чтобы uid шли не по порядку
+            yield {"tg_uid": (number * 2654435761) % 2**40 + 1, "time_zone": rnd.randint(-11, 12)}
+
+
+def max_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def traced(func):
+    """
+    Повторный вызов func под tracemalloc: пик и остаток выделенной памяти в МБ
+    """
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, round(current / 2**20, 1), round(peak / 2**20, 1)
+
+
+def timed(func):
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func()
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def run_loop(tick, fire_at: float, timeout: float) -> float | None:
+    """
+    Цикл планировщика из bot.py: проход, затем ожидание 1 с. Возвращает смещение
+    выдачи уведомлений от fire_at в секундах
+    """
+    stop = threading.Event()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if tick():
+            return time.time() - fire_at
+        stop.wait(1)
+    return None
+
+
+def bench_engine(size: int, seed: int) -> dict:
+    api = StubApi(size, seed)
+
+    def load(engine=None):
+        engine = ReminderEngine() if engine is None else engine
+        engine.load(
+            (attrib["tg_uid"], attrib["time_zone"])
+            for attrib in api.iter_users("tg_uid time_zone")
+        )
+        return engine
+
+    engine, setup, setup_cpu = timed(load)
+    del engine
+    engine, retained, peak = traced(load)
+
+    now = time.time()
+    start = time.process_time()
+    for _ in range(IDLE_TICKS):
+        engine.pop_due(now)
+    idle_tick = (time.process_time() - start) / IDLE_TICKS
+
+    fire = engine.next_fire()
+    due, due_tick, due_tick_cpu = timed(lambda: engine.pop_due(fire))
+
+    # отдельное расписание со слотом для UTC+0, который наступает после его загрузки
+    fire_at = int(time.time() + setup * 2) + DRIFT_DELAY
+    drift_engine = load(ReminderEngine(local_times=(fire_at % DAY,)))
+    drift = run_loop(lambda: drift_engine.pop_due(), fire_at, fire_at - time.time() + 3)
+
+    return {
+        "setup_s": round(setup, 3),
+        "setup_cpu_s": round(setup_cpu, 3),
+        "tracemalloc_peak_mb": peak,
+        "tracemalloc_retained_mb": retained,
+        "max_rss_mb": max_rss_mb(),
+        "idle_tick_cpu_us": round(idle_tick * 1e6, 2),
+        "due_tick_ms": round(due_tick * 1000, 3),
+        "due_users": sum(len(uids) for uids in due),
+        "drift_ms": round(drift * 1000, 1) if drift is not None else None,
+    }
+
+
+def bench_legacy(size: int, seed: int) -> dict:
+    import schedule
+
+    api = StubApi(size, seed)
+    calls = []
+    time_format = "%H:%M:%S"
+    time_send = [datetime.strptime(time_note, time_format) for time_note in ("12:00:00", "18:00:00")]
+
+    def message_reminder(uid):
+        calls.append(uid)
+
+    def load():
+        scheduler = schedule.Scheduler()
+        for attrib in api.iter_users("tg_uid time_zone"):
+            uid = attrib["tg_uid"]
+            for _time in time_send:
+                send_utc = (_time - timedelta(hours=attrib["time_zone"])).strftime(time_format)
+                scheduler.every().day.at(send_utc).do(message_reminder, uid=uid)
+        return scheduler
+
+    scheduler, setup, setup_cpu = timed(load)
+    del scheduler
+    scheduler, retained, peak = traced(load)
+
+    ticks = max(10, IDLE_TICKS // max(size // 10000, 1))
+    start = time.process_time()
+    for _ in range(ticks):
+        scheduler.run_pending()
+    idle_tick = (time.process_time() - start) / ticks
+
+    fire_at = int(time.time()) + DRIFT_DELAY
+    scheduler.every().day.at(datetime.fromtimestamp(fire_at).strftime(time_format)).do(
+        message_reminder, uid=0
+    )
+
+    def tick():
+        scheduler.run_pending()
+        return 0 in calls
+
+    drift = run_loop(tick, fire_at, DRIFT_DELAY + 3 + idle_tick * 5)
+
+    return {
+        "setup_s": round(setup, 3),
+        "setup_cpu_s": round(setup_cpu, 3),
+        "tracemalloc_peak_mb": peak,
+        "tracemalloc_retained_mb": retained,
+        "max_rss_mb": max_rss_mb(),
+        "idle_tick_cpu_us": round(idle_tick * 1e6, 2),
+        "jobs": len(scheduler.jobs),
+        "drift_ms": round(drift * 1000, 1) if drift is not None else None,
+    }
+
+
+def run_child(kind: str, size: int, seed: int) -> dict:
+    """
+    Замер в отдельном процессе, чтобы пиковый RSS и память не зависели от предыдущих размеров
+    """
+    output = subprocess.check_output(
+        [sys.executable, __file__, "--child", kind, "--sizes", str(size), "--seed", str(seed)],
+        text=True,
+    )
+    return json.loads(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк расписания уведомлений")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="пользователей"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора пользователей")
+    parser.add_argument("--legacy", action="store_true", help="сравнить с библиотекой schedule")
+    parser.add_argument(
+        "--legacy-max", type=int, default=100000, help="наибольший размер для schedule"
+    )
+    parser.add_argument("--output", help="файл для результата в формате JSON")
+    parser.add_argument("--child", choices=("engine", "legacy"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        bench = bench_engine if args.child == "engine" else bench_legacy
+        print(json.dumps(bench(args.sizes[0], args.seed)))
+        return
+
+    report = {"benchmark": "scheduler", "seed": args.seed, "results": {}}
+    for size in args.sizes:
+        result = {"engine": run_child("engine", size, args.seed)}
+        if args.legacy and size <= args.legacy_max:
+            result["legacy_schedule"] = run_child("legacy", size, args.seed)
+        report["results"][str(size)] = result
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Фейковый отправитель обновлений для режима вебхука. Без --url бот запускается в этом же
+процессе: WebhookServer на свободном порту, заглушки Telegram Bot API (считает sendMessage)
+и FastApi из bot_e2e_benchmark. С --url обновления отправляются на уже запущенный вебхук
+(например, на балансировщик перед несколькими репликами).
+
+Отправитель посылает /get_habits от случайных пользователей с заданной конкурентностью,
+как Telegram с max_connections, и проверяет, что запрос с неверным секретом отклоняется.
+Результат: статусы ответов (200, 503 при заполненной дорожке), задержка подтверждения,
+и для бота в этом процессе - время до получения всех ответов.
+
+Запуск из корня репозитория:
+    python tg_bot/benchmarks/webhook_sender.py --updates 5000 --concurrency 40 --queue-size 10
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bot_e2e_benchmark import TOKEN, FakeApi, JsonHandler, JsonServer, percentile, start
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "bench-secret"
+
+
+class ReplyCounter:
+    """
+    Заглушка Bot API: отвечает на любой метод и считает вызовы sendMessage
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.last = 0.0
+
+    def serve(self) -> JsonServer:
+        counter = self
+
+        class Handler(JsonHandler):
+            def do_POST(self):
+                method = self.path.split("?")[0].rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                result = True
+                if method == "sendMessage":
+                    with counter.lock:
+                        counter.sent += 1
+                        counter.last = time.perf_counter()
+                    result = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}
+                self.reply(200, {"ok": True, "result": result})
+
+            do_GET = do_POST
+
+        return start(JsonServer(("127.0.0.1", 0), Handler))
+
+
+def start_local_bot(args):
+    api = FakeApi(args.users, 5, args.api_latency_ms / 1000)
+    replies = ReplyCounter()
+    api_server = api.serve()
+    telegram_server = replies.serve()
+    os.environ.update(
+        TOKEN=TOKEN,
+        API_URL=f"http://127.0.0.1:{api_server.server_port}/api",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_server.server_port}/bot{{0}}/{{1}}",
+        SEND_RATE="1000000",
+        METRICS_PORT="0",
+        BOT_LANES=str(args.lanes),
+        BOT_LANE_QUEUE_SIZE=str(args.queue_size),
+    )
+    sys.path.insert(0, BOT_DIR)
+    import bot as bot_module
+    from webhook import WebhookServer
+
+    bot_module.bot.lanes.start()
+    bot_module.dispatcher.start()
+    server = WebhookServer(
+        bot_module.bot,
+        bot_module.bot.lanes,
+        host="127.0.0.1",
+        port=0,
+        secret=SECRET,
+        put_timeout=args.put_timeout,
+        peers=[],
+    )
+    server.start()
+    return f"http://127.0.0.1:{server.port}{server.path}", replies
+
+
+def make_update(update_id: int, uid: int) -> bytes:
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": "user"},
+                "text": "/get_habits",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 11}],
+            },
+        }
+    ).encode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковый отправитель обновлений вебхука")
+    parser.add_argument("--url", help="адрес вебхука; без него бот запускается в этом процессе")
+    parser.add_argument("--secret", default=SECRET, help="секрет для заголовка Telegram")
+    parser.add_argument("--updates", type=int, default=2000, help="количество обновлений")
+    parser.add_argument("--concurrency", type=int, default=40, help="одновременных запросов")
+    parser.add_argument("--users", type=int, default=1000, help="различных пользователей")
+    parser.add_argument("--lanes", type=int, default=8, help="дорожек обработки бота")
+    parser.add_argument("--queue-size", type=int, default=100, help="очередь каждой дорожки")
+    parser.add_argument("--put-timeout", type=float, default=5, help="ожидание места в очереди")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="задержка ответа API")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл для результата в формате JSON")
+    args = parser.parse_args()
+
+    replies = None
+    url = args.url
+    if url is None:
+        url, replies = start_local_bot(args)
+
+    session = requests.Session()
+    headers = {"Content-Type": "application/json"}
+    forbidden = session.post(
+        url, data=make_update(0, 1), headers=headers | {"X-Telegram-Bot-Api-Secret-Token": "bad"}
+    ).status_code
+
+    rnd = random.Random(args.seed)
+    uids = [rnd.randint(1, args.users) for _ in range(args.updates)]
+    statuses = Counter()
+    latencies = []
+    local = threading.local()
+
+    def send(number: int) -> None:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        body = make_update(number + 1, uids[number])
+        start_at = time.perf_counter()
+        try:
+            status = local.session.post(
+                url, data=body, headers=headers | {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+            ).status_code
+        except requests.RequestException:
+            status = "error"
+        latencies.append(time.perf_counter() - start_at)
+        statuses[status] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(send, range(args.updates)))
+    sent_in = time.perf_counter() - started
+
+    report = {
+        "benchmark": "webhook_sender",
+        "config": vars(args),
+        "forbidden_status": forbidden,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "send_seconds": round(sent_in, 2),
+        "updates_per_second": round(args.updates / sent_in, 1),
+    }
+    latencies.sort()
+    report["ack_latency"] = {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    if replies is not None:
+        # каждое принятое /get_habits дает один ответ
+        expected = statuses[200]
+        deadline = time.perf_counter() + 60
+        while replies.sent < expected and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        report["replies"] = replies.sent
+        report["processed_seconds"] = round(replies.last - started, 2)
+        report["processed_per_second"] = round(replies.sent / (replies.last - started), 1)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,24 @@ import logging
 import os
 import threading
 import time
-from datetime import datetime, timedelta
+from array import array
 
-import requests
-import schedule
 from dotenv import load_dotenv, find_dotenv
 
 import telebot
-from telebot import TeleBot
-from requests.exceptions import ConnectionError, ReadTimeout
+from telebot import TeleBot, apihelper
+from requests.exceptions import ChunkedEncodingError, ConnectionError, ReadTimeout
 from telebot.apihelper import ApiTelegramException
 from urllib3.exceptions import NewConnectionError, MaxRetryError
 
+from api_client import ApiClient
+from chat_state import ChatStateStore
+from dispatcher import ReminderDispatcher
+from lanes import BOT_LANES, LaneDispatcher
+from metrics import Gauge, scheduler_tick, start_server, timed_handler, user_cache_lookups
+from reminders import ReminderEngine
+from user_cache import UserSnapshotCache
+from webhook import WEBHOOK_PEERS, WEBHOOK_URL, WebhookServer
 from messages import (
     help,
     menu,
@@ -24,41 +30,68 @@ from messages import (
     congratulations,
     greetings,
     commands,
+    TIMEZONES,
 )
 
 load_dotenv(find_dotenv())
 
 TOKEN = os.getenv("TOKEN")
+# уведомления по когортам из /api/due_users вместо расписания в памяти бота
+REMINDERS_FROM_API = os.getenv("REMINDERS_FROM_API") == "1"
+# адрес Bot API, например локального telegram-bot-api или тестовой заглушки
+if os.getenv("TELEGRAM_API_URL"):
+    apihelper.API_URL = os.getenv("TELEGRAM_API_URL")
 
-bot = TeleBot(TOKEN)
-
-TIMEZONES = [
-    "UTC+0",
-    "UTC+1",
-    "UTC+2",
-    "UTC+3",
-    "UTC+4",
-    "UTC+5",
-    "UTC+6",
-    "UTC+7",
-    "UTC+8",
-    "UTC+9",
-    "UTC+10",
-    "UTC+11",
-    "UTC+12",
-]
-
-# для использования вне контейнера
-# BASE_URL = "http://127.0.0.1:8088/api"
-
-# для использования в контейнере
-BASE_URL = "http://api:8088/api"
-
-HEADERS = {"authorization-token": "token"}
-all_habits = []
-delete_habit = False
+
+class HabitBot(TeleBot):
+    """
+    Обновления обрабатываются в дорожках LaneDispatcher: по порядку внутри одного чата
+    и параллельно для разных чатов. Обработчики выполняются в потоке дорожки
+    """
+
+    def __init__(self, token: str, lanes: int = BOT_LANES, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        self.lanes = LaneDispatcher(self.process_update, lanes)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # offset следующего getUpdates сдвигается сразу, а не после обработки в дорожке
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.lanes.submit(update)
+
+    def process_update(self, update) -> None:
+        # TeleBot получает по одному обновлению, поэтому его обработчики следующего шага
+        # (register_next_step_handler) не теряют ответы из одного пакета getUpdates
+        super().process_new_updates([update])
+
+
+bot = HabitBot(TOKEN)
+
+api = ApiClient()
+reminders = ReminderEngine()
+dispatcher = ReminderDispatcher(bot)
+chat_states = ChatStateStore()
+user_cache = UserSnapshotCache()
 stop_event = threading.Event()
 
+Gauge(
+    "bot_reminder_backlog",
+    "Уведомления, ожидающие отправки",
+    collect=lambda: {(): dispatcher.stats()["backlog"]},
+)
+Gauge(
+    "bot_scheduled_users",
+    "Пользователи в расписании уведомлений",
+    collect=lambda: {(): len(reminders)},
+)
+Gauge(
+    "bot_messages",
+    "Отправленные и неотправленные сообщения с момента запуска",
+    ("result",),
+    collect=lambda: {("sent",): dispatcher.sent, ("failed",): dispatcher.failed},
+)
+
 logging.basicConfig(
     level=20,
     format="%(asctime)s || %(name)s || %(levelname)s || %(message)s || %(module)s.%(funcName)s:%(lineno)d",
@@ -68,8 +101,8 @@ logger.info("Запуск бота")
 
 
 @bot.message_handler(commands=commands)
+@timed_handler
 def get_text_commands(message: telebot) -> None:
-    global delete_habit
     command = message.text[1:]
     user_id = message.from_user.id
     print(user_id, ":", message.text)
@@ -78,19 +111,19 @@ def get_text_commands(message: telebot) -> None:
             result = get_user(user_id)
             if not result["result"]:
                 print("if not result[result]")
-                bot.send_message(
+                send_message(
                     message.from_user.id,
                     f"Привет, {message.from_user.full_name}! {start}",
                 )
             else:
-                bot.send_message(
+                send_message(
                     message.from_user.id,
                     f"С возвращением, {message.from_user.full_name}! Проработаем привычки? :) - /get_habits",
                 )
         elif command == "help":
-            bot.send_message(message.from_user.id, f"{help}")
+            send_message(message.from_user.id, f"{help}")
         elif command == "menu":
-            bot.send_message(message.from_user.id, menu)
+            send_message(message.from_user.id, menu)
         elif command == "time_zone":
             # создаем клавиатуру для выбора часового пояса
             markup = telebot.types.ReplyKeyboardMarkup(
@@ -98,7 +131,7 @@ def get_text_commands(message: telebot) -> None:
             )
             for tz in TIMEZONES:
                 markup.add(tz)
-            bot.send_message(
+            send_message(
                 message.chat.id, "Выберите ваш часовой пояс:", reply_markup=markup
             )
         elif command in ("get_habits", "delete_habit"):
@@ -107,16 +140,15 @@ def get_text_commands(message: telebot) -> None:
                 habits = result["user"]["habits"]
                 completed = result["user"]["completed"]
                 # print(habits)
-                delete_habit = command == "delete_habit"
                 if habits:
-                    list_habits(bot, message, habits)
+                    list_habits(bot, message, habits, command == "delete_habit")
                 elif not completed:
-                    bot.send_message(
+                    send_message(
                         message.chat.id,
                         empty_list,
                     )
                 else:
-                    bot.send_message(
+                    send_message(
                         message.chat.id,
                         f"Список привычек пуст, но, вижу, есть уже выученные: *{", ".join(completed)}*. "
                         rf"Не будем останавливаться на достигнутом и разучим новую? /add\_habit",
@@ -131,13 +163,14 @@ def get_text_commands(message: telebot) -> None:
         elif command == "add_habit":
             result = get_user(user_id)
             if result["result"]:
-                bot.send_message(
-                    message.chat.id,
-                    "Опишите привычку, которую хотите выучить. /menu",
-                )
+                # обработчик регистрируется до ответа, иначе быстрый ответ пользователя его опередит
                 bot.register_next_step_handler(
                     message, callback=add_habit, result=result
                 )
+                send_message(
+                    message.chat.id,
+                    "Опишите привычку, которую хотите выучить. /menu",
+                )
             else:
                 error_message(
                     bot,
@@ -158,13 +191,13 @@ def get_text_commands(message: telebot) -> None:
             if result["result"]:
                 completed = result["user"]["completed"]
                 if completed:
-                    bot.send_message(
+                    send_message(
                         user_id,
                         f"Вот все ваши проработанные привычки: \n*{", ".join(completed)}*. \n/menu",
                         parse_mode="Markdown",
                     )
                 else:
-                    bot.send_message(
+                    send_message(
                         user_id,
                         "Вы еще не проработали ни одной привычки. Список привычек - /get_habits",
                     )
@@ -178,11 +211,11 @@ def get_text_commands(message: telebot) -> None:
             result = get_user(user_id)
             if result["result"]:
                 repeat_number = result["user"]["repeat_number"]
-                bot.send_message(
+                bot.register_next_step_handler(message, callback=set_repeat_number)
+                send_message(
                     user_id,
                     f"Для изменения числа повторения привычки введите число от 10 до 50. Текущее значение: {repeat_number}",
                 )
-                bot.register_next_step_handler(message, callback=set_repeat_number)
             else:
                 error_message(
                     bot,
@@ -192,11 +225,11 @@ def get_text_commands(message: telebot) -> None:
         elif command == "delete_account":
             result = get_user(user_id)
             if result["result"]:
-                bot.send_message(
+                bot.register_next_step_handler(message, callback=delete_account)
+                send_message(
                     user_id,
                     "Если вы хотите удалить свою учетную запись без возможнсти восстановления данных - введите слово 'да'",
                 )
-                bot.register_next_step_handler(message, callback=delete_account)
             else:
                 error_message(
                     bot,
@@ -209,49 +242,43 @@ def get_text_commands(message: telebot) -> None:
         error_message(bot, message, something_went_wrong)
 
 
-@bot.message_handler(func=lambda message: message.text in all_habits)
+@bot.message_handler(
+    func=lambda message: chat_states.has_button(message.chat.id, message.text)
+)
+@timed_handler
 def habit_selected(message):
     """
     Функция выбора привычки для проработки/удаления
     """
-    global delete_habit
-    all_habits.clear()
+    state = chat_states.pop(message.chat.id)
     user_id = message.from_user.id
-    result = get_user(user_id)
-    completed = result["user"]["completed"]
-    if delete_habit:
+    if state is not None and state.delete_mode:
+        result = get_user(user_id)
         habit = message.text
         result["user"]["habits"].pop(habit)
+        patch_user({"habits": result["user"]["habits"], "tg_uid": user_id})
         text = f"Привычка '{habit}' удалена. /get_habits, /menu"
+        habits = get_user(user_id)["user"]["habits"]
     else:
         habit = " ".join(message.text.split()[:-1])
-        repeated = int(message.text.split()[-1])
-        repeat_number = result["user"]["repeat_number"]
-        print(repeat_number, repeated)
-        if repeated >= repeat_number - 1:
-            result["user"]["habits"].pop(habit)
-            completed.append(habit)
+        result = complete_habit(user_id, habit)
+        if not result["result"]:
+            error_message(bot, message, something_went_wrong)
+            return
+        if result["done"]:
             text = f"Поздравляем, вы проработали привычку '{habit}'!"
         else:
-            result["user"]["habits"][habit] += 1
-            text = f"Привычка '{habit}' выполнена. Осталось еще {repeat_number - repeated - 1}"
-    completed = completed if completed else None
-    data = {
-        "habits": result["user"]["habits"],
-        "tg_uid": user_id,
-        "completed": completed,
-    }
-    patch_user(data)
-    bot.send_message(message.chat.id, text)
-    habits = get_user(user_id)["user"]["habits"]
-    delete_habit = False
+            text = f"Привычка '{habit}' выполнена. Осталось еще {result["repeat_number"] - result["count"]}"
+        habits = result["habits"]
+    send_message(message.chat.id, text)
     list_habits(bot, message, habits)
 
 
 @bot.message_handler(func=lambda message: message.text in TIMEZONES)
+@timed_handler
 def timezone_selected(message):
     """
-    Функция выбора/изменения часового пояса и регистрации нового пользователя После регистрации перезапускается поток scheduler, чтобы учесть изменения в базе
+    Функция выбора/изменения часового пояса и регистрации нового пользователя. Расписание уведомлений обновляется только для этого пользователя
     """
     user_timezone = message.text
     time_zone = user_timezone.split("+")[-1]
@@ -265,7 +292,8 @@ def timezone_selected(message):
         if result["result"]:
             result = patch_user(data)
             if result["result"]:
-                bot.send_message(
+                reminders.update(user_id, int(time_zone))
+                send_message(
                     message.chat.id,
                     f"Ваш часовой пояс установлен: {user_timezone} /menu",
                 )
@@ -274,20 +302,11 @@ def timezone_selected(message):
 
         else:
             print("data", data)
-            result = requests.post(
-                f"{BASE_URL}/make_user",
-                headers=HEADERS,
-                json=data,
-                timeout=(3, 3),
-            ).json()
+            result = make_user(data)
             print("result", result)
             if result["result"]:
-                stop_event.set()
-                bot.send_message(message.chat.id, congratulations)
-                time.sleep(1)
-                stop_event.clear()
-                thread = threading.Thread(target=scheduler)
-                thread.start()
+                reminders.add(user_id, int(time_zone))
+                send_message(message.chat.id, congratulations)
             else:
                 error_message(bot, message, something_went_wrong)
     except ConnectionError as ex:
@@ -296,6 +315,7 @@ def timezone_selected(message):
 
 
 @bot.message_handler(content_types=["text"])
+@timed_handler
 def get_text_messages(message: telebot) -> None:
     """Функция интерактивного диалога с пользователем в режиме реакции на любой текст."""
 
@@ -303,45 +323,38 @@ def get_text_messages(message: telebot) -> None:
     print(f"{user_id = }:", f"'{message.text}'")
 
     if message.text.lower() in greetings:
-        bot.send_message(
+        send_message(
             message.from_user.id,
             f"{message.from_user.full_name}, и вам здравствуйте. Какую привычку сегодня вам угодно проработать? :) - /get_habits",
         )
     elif message.text == "стопбот111":
         stop_event.set()
-        bot.send_message(message.from_user.id, "Бот остановлен")
+        send_message(message.from_user.id, "Бот остановлен")
         bot.stop_polling()
     else:
-        bot.send_message(
+        send_message(
             message.from_user.id,
             f"{message.from_user.full_name}, пожалуйста, выберите команду из /menu",
         )
 
 
+@timed_handler
 def delete_account(message):
     """
-    Функция удаления аккаунта пользователя. После удаления перезапускается поток scheduler, чтобы учесть изменения в базе
+    Функция удаления аккаунта пользователя. Пользователь удаляется из расписания уведомлений
     """
     user_id = message.from_user.id
     text = message.text
     if text == "да":
-        result = requests.delete(
-            f"{BASE_URL}/delete_user",
-            headers=HEADERS | {"tg-uid": f"{user_id}"},
-            timeout=(3, 3),
-        ).json()
+        result = delete_user(user_id)
         print(result)
         if result:
-            stop_event.set()
-            bot.send_message(
+            reminders.remove(user_id)
+            send_message(
                 user_id,
                 "Ваша учетная запись удалена. Но вы всегда можете создать новую, с новыми привычками :)."
                 " Для регистрации укажите ваш часовой пояс - /time_zone",
             )
-            time.sleep(1)
-            stop_event.clear()
-            thread = threading.Thread(target=scheduler)
-            thread.start()
         else:
             error_message(bot, message, something_went_wrong)
     else:
@@ -352,100 +365,115 @@ def delete_account(message):
         )
 
 
+@timed_handler
 def set_repeat_number(message):
     text = message.text
     user_id = message.from_user.id
     if text.isdigit() and 10 <= int(text) <= 50:
         data = {"tg_uid": user_id, "repeat_number": text}
         patch_user(data)
-        bot.send_message(
+        send_message(
             user_id,
             f"Ваше число повторений привычки для проработки: {text}. Список привычек - /get_habits",
         )
     else:
-        bot.send_message(user_id, "Ошибка ввода данных. Нужно ввести число от 10 до 50")
         bot.register_next_step_handler(message, callback=set_repeat_number)
+        send_message(user_id, "Ошибка ввода данных. Нужно ввести число от 10 до 50")
 
 
-def list_habits(bot, message, habits):
+def list_habits(bot, message, habits, delete_habit=False):
     markup = telebot.types.ReplyKeyboardMarkup(
         one_time_keyboard=True, resize_keyboard=True
     )
 
+    buttons = []
     for key in habits:
         habit = f"{key} {habits.get(key)}" if not delete_habit else key
         # print(habit)
-        all_habits.append(habit)
+        buttons.append(habit)
         markup.add(habit)
-    # print(all_habits)
+    chat_states.set_buttons(message.chat.id, buttons, delete_habit)
     text = (
         "Вот ваш список привычек для проработки. Нажмите на кнопку с привычкой чтобы отметить ее выполнение. \n/menu"
         if not delete_habit
         else "Выберите привычку, которую хотите удалить. /menu"
     )
-    bot.send_message(message.chat.id, text, reply_markup=markup)
-    print(all_habits)
+    send_message(message.chat.id, text, reply_markup=markup)
 
 
-def message_reminder(uid):
-    bot.send_message(uid, "Не забывайте прорабатывать привычки ;) - /get_habits")
+def send_message(chat_id, text, **kwargs):
+    """
+    Отправка интерактивного ответа вне очереди уведомлений, но с общим ограничением частоты
+    """
+    return dispatcher.send_now(chat_id, text, **kwargs)
+
+
+def message_reminder(uids):
+    dispatcher.submit_many(uids, "Не забывайте прорабатывать привычки ;) - /get_habits")
 
 
 def scheduler():
     """
-    Функция периодической отправки уведомлений пользователям с учетом их временных хон
+    Функция периодической отправки уведомлений пользователям с учетом их временных зон
     """
-    schedule.clear()
+    if REMINDERS_FROM_API:
+        return api_scheduler()
     print("run_scheduler")
-    while True:
+    while not stop_event.is_set():
         try:
-            result = requests.get(
-                f"{BASE_URL}/get_users",
-                headers=HEADERS | {"attrib": "tg_uid time_zone"},
-                timeout=(3, 3),
-            ).json()
-            if result.get("users", []) is not None:
-                break
+            reminders.load(
+                (attrib["tg_uid"], attrib["time_zone"])
+                for attrib in api.iter_users("tg_uid time_zone")
+            )
+            break
+        except (ConnectionError, ChunkedEncodingError, ReadTimeout, ValueError) as ex:
+            logger.error(f"Не удалось загрузить пользователей, {ex}")
             time.sleep(1)
-        except ConnectionError as ex:
-            pass
-
-    logger.info(result)
-    format = "%H:%M:%S"
-    time_send = [
-        datetime.strptime(time_note, format) for time_note in ("12:00:00", "18:00:00")
-    ]
-    if result.get("users"):
-        for attrib in result["users"]:
-            uid = attrib["tg_uid"]
-            time_zone = attrib["time_zone"]
-            time_send_utc = [
-                (_time - timedelta(hours=time_zone)).strftime(format)
-                for _time in time_send
-            ]
-            [
-                schedule.every().day.at(_time).do(message_reminder, uid=uid)
-                for _time in time_send_utc
-            ]
+    logger.info(f"Загружено уведомлений для {len(reminders)} пользователей")
 
     while not stop_event.is_set():
-        schedule.run_pending()
-        time.sleep(1)
-        if stop_event.is_set():
-            print("stop_scheduler")
+        start = time.perf_counter()
+        for uids in reminders.pop_due():
+            message_reminder(uids)
+        scheduler_tick.observe(time.perf_counter() - start)
+        stop_event.wait(1)
+    print("stop_scheduler")
+
+
+def api_scheduler():
+    """
+    Отправка уведомлений по когортам, которые в начале каждого часа UTC выбирает FastApi (/due_users).
+    Бот не хранит список пользователей
+    """
+    print("run_scheduler")
+    next_hour = (time.time() // 3600 + 1) * 3600
+    while not stop_event.wait(min(1, max(0, next_hour - time.time()))):
+        if time.time() < next_hour:
+            continue
+        start = time.perf_counter()
+        try:
+            uids = api.get_due_users(int(next_hour // 3600 % 24))
+            if uids:
+                message_reminder(array("q", uids))
+        except (ConnectionError, ReadTimeout, ValueError) as ex:
+            logger.error(f"Не удалось получить пользователей для уведомления, {ex}")
+        scheduler_tick.observe(time.perf_counter() - start)
+        next_hour += 3600
+    print("stop_scheduler")
 
 
 def error_message(bot, message, text):
-    bot.send_message(message.chat.id, f"{text}")
+    send_message(message.chat.id, f"{text}")
 
 
+@timed_handler
 def add_habit(message, result):
     text = message.text.lstrip("/")
     if len(text) > 40:
-        bot.send_message(message.chat.id, "В описании привычки должно быть не более 40 символов. Попробуйте еще раз.")
         bot.register_next_step_handler(
             message, callback=add_habit, result=result
         )
+        send_message(message.chat.id, "В описании привычки должно быть не более 40 символов. Попробуйте еще раз.")
     else:
         user_id = message.from_user.id
         # result = get_user(user_id)
@@ -458,11 +486,11 @@ def add_habit(message, result):
             result = get_user(user_id)
             habits = result["user"]["habits"]
 
-            bot.send_message(message.chat.id, f"Привычка '{text}' добавлена!")
+            send_message(message.chat.id, f"Привычка '{text}' добавлена!")
             if habits:
                 list_habits(bot, message, habits)
             else:
-                bot.send_message(
+                send_message(
                     message.chat.id,
                     empty_list,
                 )
@@ -471,25 +499,78 @@ def add_habit(message, result):
 
 
 def get_user(user_id):
-    result = requests.get(
-        f"{BASE_URL}/user",
-        headers=HEADERS | {"tg-uid": f"{user_id}"},
-        timeout=(3, 3),
-    ).json()
-
+    """
+    Данные пользователя из кэша снимков, при промахе - из API
+    """
+    user = user_cache.get(user_id)
+    if user is not None:
+        user_cache_lookups.inc("hit")
+        return {"result": True, "user": user}
+    user_cache_lookups.inc("miss")
+    result = api.get_user(user_id)
+    if result["result"]:
+        user_cache.put(user_id, result["user"])
     return result
 
 
 def patch_user(data):
-    result = requests.patch(
-        f"{BASE_URL}/change_user", headers=HEADERS, json=data, timeout=(3, 3)
-    ).json()
+    result = api.patch_user(data)
+    if result["result"]:
+        user_cache.update(data["tg_uid"], data)
+    else:
+        user_cache.invalidate(data["tg_uid"])
+    return result
 
+
+def make_user(data):
+    result = api.make_user(data)
+    if result["result"]:
+        user_cache.put(data["tg_uid"], result["user"])
     return result
 
 
+def complete_habit(user_id, habit):
+    result = api.complete_habit(user_id, habit)
+    if result["result"]:
+        user_cache.update(
+            user_id,
+            {key: result[key] for key in ("habits", "completed", "repeat_number")},
+        )
+    else:
+        user_cache.invalidate(user_id)
+    return result
+
+
+def delete_user(user_id):
+    user_cache.invalidate(user_id)
+    return api.delete_user(user_id)
+
+
+def run_webhook():
+    """
+    Режим вебхука: принятые обновления ставятся в дорожки бота. Уведомления рассылает
+    и вебхук регистрирует только реплика 0. Регистрации, смены часового пояса и удаления
+    обрабатывает реплика-владелец чата, а расписание в памяти есть только у реплики 0,
+    поэтому при нескольких репликах уведомления берутся из FastApi (REMINDERS_FROM_API=1)
+    """
+    if len(WEBHOOK_PEERS) > 1 and not REMINDERS_FROM_API:
+        logger.error("При нескольких репликах (WEBHOOK_PEERS) нужен REMINDERS_FROM_API=1")
+        raise SystemExit(1)
+    bot.lanes.start()
+    dispatcher.start()
+    server = WebhookServer(bot, bot.lanes)
+    if server.replica == 0:
+        server.register(WEBHOOK_URL)
+        threading.Thread(target=scheduler, daemon=True).start()
+    server.start(background=False)
+
+
 def main():
+    if WEBHOOK_URL:
+        return run_webhook()
     try:
+        bot.lanes.start()
+        dispatcher.start()
         thread = threading.Thread(target=scheduler)
         thread.start()
         bot.polling(none_stop=True)
@@ -504,4 +585,5 @@ def main():
 
 
 if __name__ == "__main__":
+    start_server()
     main()
@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+CHAT_STATE_SIZE = int(os.getenv("CHAT_STATE_SIZE", 100000))
+CHAT_STATE_TTL = float(os.getenv("CHAT_STATE_TTL", 3600))
+
+
+class ChatState:
+    """
+    Состояние диалога одного чата: кнопки показанного списка привычек и режим удаления
+    """
+
+    __slots__ = ("buttons", "delete_mode", "expires")
+
+    def __init__(self, buttons: frozenset, delete_mode: bool, expires: float):
+        self.buttons = buttons
+        self.delete_mode = delete_mode
+        self.expires = expires
+
+
+class ChatStateStore:
+    """
+    Состояния диалогов по chat_id с ограничением количества записей (вытесняются давно
+    не использованные) и временем жизни. Проверка нажатой кнопки - поиск в множестве, O(1)
+    """
+
+    def __init__(self, maxsize: int = CHAT_STATE_SIZE, ttl: float = CHAT_STATE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.states: OrderedDict[int, ChatState] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def set_buttons(self, chat_id: int, buttons: Iterable[str], delete_mode: bool = False) -> None:
+        state = ChatState(frozenset(buttons), delete_mode, time.monotonic() + self.ttl)
+        with self.lock:
+            self.states[chat_id] = state
+            self.states.move_to_end(chat_id)
+            while len(self.states) > self.maxsize:
+                self.states.popitem(last=False)
+
+    def get(self, chat_id: int) -> ChatState | None:
+        with self.lock:
+            state = self.states.get(chat_id)
+            if state is None:
+                return None
+            if state.expires <= time.monotonic():
+                del self.states[chat_id]
+                return None
+            self.states.move_to_end(chat_id)
+            return state
+
+    def has_button(self, chat_id: int, text: str | None) -> bool:
+        state = self.get(chat_id)
+        return state is not None and text in state.buttons
+
+    def pop(self, chat_id: int) -> ChatState | None:
+        with self.lock:
+            state = self.states.pop(chat_id, None)
+        if state is None or state.expires <= time.monotonic():
+            return None
+        return state
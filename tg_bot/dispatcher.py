@@ -0,0 +1,181 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+from metrics import send_latency, send_wait
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+SEND_RATE = float(os.getenv("SEND_RATE", 25))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 8))
+SEND_RETRIES = 3
+BULK_CHUNK = 100
+REPORT_INTERVAL = 60
+
+logger = logging.getLogger("dispatcher")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты отправки: rate токенов в секунду, не более capacity подряд.
+    Пока токена ждет хотя бы один интерактивный ответ, массовые отправки токены не получают
+    """
+
+    def __init__(self, rate: float = SEND_RATE, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.interactive_waiting = 0
+        self.cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = BULK) -> None:
+        with self.cond:
+            if priority == INTERACTIVE:
+                self.interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (
+                        now >= self.blocked_until
+                        and self.tokens >= 1
+                        and (priority == INTERACTIVE or not self.interactive_waiting)
+                    ):
+                        self.tokens -= 1
+                        return
+                    self.cond.wait(
+                        max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.01)
+                    )
+            finally:
+                if priority == INTERACTIVE:
+                    self.interactive_waiting -= 1
+                    self.cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Остановка всех отправок на seconds секунд (ответ 429 с retry_after)
+        """
+        with self.cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class ReminderDispatcher:
+    """
+    Отправка сообщений через пул потоков с общим ограничителем частоты.
+    Интерактивные ответы отправляются сразу в потоке обработчика и имеют приоритет
+    над массовыми уведомлениями, которые ставятся в очередь
+    """
+
+    def __init__(self, bot: TeleBot, workers: int = SEND_WORKERS, rate: float = SEND_RATE):
+        self.bot = bot
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.sent = 0
+        self.failed = 0
+        self.pending = 0
+        self.throughput = 0.0
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self) -> None:
+        if self.threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"sender-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        threading.Thread(target=self._reporter, name="sender-report", daemon=True).start()
+
+    def submit(self, chat_id: int, text: str, priority: int = BULK, **kwargs) -> None:
+        self.submit_many((chat_id,), text, priority, **kwargs)
+
+    def submit_many(self, chat_ids, text: str, priority: int = BULK, **kwargs) -> None:
+        """
+        Постановка одного сообщения для многих получателей. В очередь попадают срезы
+        по BULK_CHUNK uid, а не отдельная запись на каждого пользователя
+        """
+        with self.lock:
+            self.pending += len(chat_ids)
+        for start in range(0, len(chat_ids), BULK_CHUNK):
+            chunk = chat_ids[start : start + BULK_CHUNK]
+            self.queue.put((priority, next(self.counter), chunk, text, kwargs))
+
+    def send_now(self, chat_id: int, text: str, **kwargs):
+        return self._send(chat_id, text, INTERACTIVE, **kwargs)
+
+    def _send(self, chat_id: int, text: str, priority: int, **kwargs):
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        for attempt in range(SEND_RETRIES + 1):
+            start = time.perf_counter()
+            self.limiter.acquire(priority)
+            sent_at = time.perf_counter()
+            send_wait.observe(sent_at - start, label)
+            try:
+                message = self.bot.send_message(chat_id, text, **kwargs)
+            except ApiTelegramException as ex:
+                if ex.error_code != 429 or attempt == SEND_RETRIES:
+                    with self.lock:
+                        self.failed += 1
+                    raise
+                retry_after = ex.result_json.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Превышен лимит отправки, пауза {retry_after} с")
+                self.limiter.pause(retry_after)
+                continue
+            finally:
+                send_latency.observe(time.perf_counter() - sent_at, label)
+            with self.lock:
+                self.sent += 1
+            return message
+
+    def _worker(self) -> None:
+        while True:
+            priority, _, chat_ids, text, kwargs = self.queue.get()
+            for chat_id in chat_ids:
+                try:
+                    self._send(chat_id, text, priority, **kwargs)
+                except Exception as ex:
+                    logger.error(f"Не удалось отправить сообщение {chat_id}: {ex}")
+                finally:
+                    with self.lock:
+                        self.pending -= 1
+            self.queue.task_done()
+
+    def stats(self) -> dict:
+        with self.lock:
+            sent, failed, pending = self.sent, self.failed, self.pending
+        return {
+            "sent": sent,
+            "failed": failed,
+            "throughput": self.throughput,
+            "backlog": pending,
+        }
+
+    def _reporter(self) -> None:
+        last_sent = 0
+        while True:
+            time.sleep(REPORT_INTERVAL)
+            stats = self.stats()
+            self.throughput = (stats["sent"] - last_sent) / REPORT_INTERVAL
+            if stats["sent"] != last_sent or stats["backlog"]:
+                logger.info(
+                    f"Отправлено: {self.throughput:.1f} сообщ./с, "
+                    f"ошибок всего: {stats['failed']}, в очереди: {stats['backlog']}"
+                )
+            last_sent = stats["sent"]
@@ -0,0 +1,120 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable
+
+from telebot import types
+
+from metrics import Gauge, lane_latency, lane_wait
+
+# число дорожек (параллельно обрабатываемых чатов) и размер очереди каждой из них
+BOT_LANES = max(int(os.getenv("BOT_LANES", 8)), 1)
+BOT_LANE_QUEUE_SIZE = int(os.getenv("BOT_LANE_QUEUE_SIZE", 100))
+
+logger = logging.getLogger("lanes")
+
+
+def update_chat_id(update: types.Update) -> int:
+    """
+    chat.id обновления, для обновлений без чата - id пользователя
+    """
+    for value in vars(update).values():
+        if value is None or isinstance(value, int):
+            continue
+        message = getattr(value, "message", None)
+        chat = getattr(value, "chat", None) or getattr(message, "chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(value, "from_user", None) or getattr(value, "user", None)
+        if user is not None:
+            return user.id
+    return 0
+
+
+class LaneDispatcher:
+    """
+    Обработка обновлений в дорожках: каждая дорожка - очередь и один поток. Обновления
+    одного чата всегда попадают в одну дорожку и обрабатываются строго по порядку,
+    разные чаты обрабатываются параллельно в разных дорожках
+    """
+
+    def __init__(
+        self,
+        handle: Callable[[types.Update], None],
+        lanes: int = BOT_LANES,
+        queue_size: int = BOT_LANE_QUEUE_SIZE,
+    ):
+        self.handle = handle
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(lanes)]
+        self.threads = []
+        Gauge(
+            "bot_lane_queue",
+            "Обновления в очереди дорожки",
+            ("lane",),
+            collect=lambda: {
+                (str(lane),): tasks.qsize() for lane, tasks in enumerate(self.queues)
+            },
+        )
+
+    def start(self) -> None:
+        if self.threads:
+            return
+        for lane in range(len(self.queues)):
+            thread = threading.Thread(
+                target=self._worker, args=(lane,), name=f"lane-{lane}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def lane(self, chat_id: int) -> int:
+        # мультипликативное перемешивание: реплики вебхука делят чаты по chat.id по модулю,
+        # и без него на реплике были бы заняты только дорожки с подходящим остатком
+        return (chat_id * 11400714819323198485 % 2**64 >> 32) % len(self.queues)
+
+    def submit(self, update: types.Update, timeout: float | None = None) -> bool:
+        """
+        Постановка обновления в дорожку его чата. Если дорожка заполнена, ждет timeout
+        секунд (None - без ограничения) и возвращает False, если место не освободилось
+        """
+        tasks = self.queues[self.lane(update_chat_id(update))]
+        try:
+            tasks.put((time.perf_counter(), update), timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def _worker(self, lane: int) -> None:
+        name = str(lane)
+        tasks = self.queues[lane]
+        while True:
+            queued, update = tasks.get()
+            start = time.perf_counter()
+            lane_wait.observe(start - queued, name)
+            try:
+                self.handle(update)
+            except Exception as ex:
+                logger.exception(f"Ошибка обработки обновления {update.update_id}: {ex}")
+            finally:
+                lane_latency.observe(time.perf_counter() - start, name)
+                tasks.task_done()
+
+    def join(self) -> None:
+        """
+        Ожидание обработки всех поставленных обновлений
+        """
+        for tasks in self.queues:
+            tasks.join()
+
+    def full(self) -> bool:
+        return any(tasks.full() for tasks in self.queues)
+
+    def stats(self) -> dict:
+        sizes = [tasks.qsize() for tasks in self.queues]
+        return {
+            "lanes": len(sizes),
+            "queued": sum(sizes),
+            "busiest": max(sizes),
+            "queue_size": self.queues[0].maxsize,
+        }
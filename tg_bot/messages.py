@@ -70,3 +70,19 @@ commands = [
     "run_scheduler",
     "stop_scheduler",
 ]
+
+TIMEZONES = [
+    "UTC+0",
+    "UTC+1",
+    "UTC+2",
+    "UTC+3",
+    "UTC+4",
+    "UTC+5",
+    "UTC+6",
+    "UTC+7",
+    "UTC+8",
+    "UTC+9",
+    "UTC+10",
+    "UTC+11",
+    "UTC+12",
+]
@@ -0,0 +1,243 @@
+"""
+Метрики бота в текстовом формате Prometheus: счетчики и гистограммы в памяти процесса
+и небольшой HTTP-сервер, отдающий их по /metrics. Запись метрик выполняется из потоков
+обработчиков и рассылки, поэтому у каждой метрики своя блокировка
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Tuple
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 - не запускать HTTP-сервер метрик
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9101))
+
+# границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("metrics")
+
+registry: List["Metric"] = []
+
+
+def label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{label_text(self.labels, label_values)} {value}"
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Вместо set можно передать функцию, которая вызывается при выдаче метрик
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        collect: Callable[[], Dict[tuple, float]] | None = None,
+    ):
+        super().__init__(name, description, labels)
+        self.values: Dict[tuple, float] = {}
+        self.collect = collect
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values) -> None:
+        with self.lock:
+            self.values[label_values] = value
+
+    def samples(self) -> Iterable[str]:
+        if self.collect:
+            values = sorted(self.collect().items())
+        else:
+            with self.lock:
+                values = sorted(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{label_text(self.labels, label_values)} {value}"
+
+
+class Histogram(Metric):
+    """
+    Гистограмма с фиксированными корзинами: для каждого набора меток список
+    [счетчики корзин..., сумма, количество]
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(label_values)
+            if data is None:
+                data = self.values[label_values] = [0] * (len(self.buckets) + 3)
+            data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            values = sorted((key, list(data)) for key, data in self.values.items())
+        for label_values, data in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data):
+                cumulative += count
+                labels = label_text(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = label_text(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {data[-2]}"
+            yield f"{self.name}_count{labels} {data[-1]}"
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+handler_latency = Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика сообщения", ("handler",)
+)
+handler_errors = Counter(
+    "bot_handler_errors_total", "Обработчики, завершившиеся исключением", ("handler",)
+)
+update_lag = Histogram(
+    "bot_update_lag_seconds",
+    "Задержка от отправки сообщения пользователем до начала обработки (точность 1 с)",
+    ("handler",),
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0),
+)
+api_latency = Histogram(
+    "bot_api_request_duration_seconds", "Время запроса к FastApi", ("endpoint", "status")
+)
+api_errors = Counter(
+    "bot_api_errors_total", "Ошибки соединения с FastApi", ("endpoint", "error")
+)
+user_cache_lookups = Counter(
+    "bot_user_cache_total", "Обращения к кэшу данных пользователей", ("result",)
+)
+send_latency = Histogram(
+    "bot_telegram_send_duration_seconds", "Время вызова send_message Telegram", ("priority",)
+)
+send_wait = Histogram(
+    "bot_send_wait_seconds", "Ожидание ограничителя частоты перед отправкой", ("priority",)
+)
+scheduler_tick = Histogram(
+    "bot_scheduler_tick_seconds", "Время одного прохода планировщика уведомлений"
+)
+lane_wait = Histogram(
+    "bot_lane_wait_seconds", "Ожидание обновления в очереди дорожки", ("lane",)
+)
+lane_latency = Histogram(
+    "bot_lane_duration_seconds", "Время обработки обновления в дорожке", ("lane",)
+)
+
+
+def timed_handler(func):
+    """
+    Учет времени работы обработчика сообщений, его ошибок и задержки обработки
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(message, *args, **kwargs):
+        start = time.perf_counter()
+        update_lag.observe(max(time.time() - message.date, 0), name)
+        try:
+            return func(message, *args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> ThreadingHTTPServer | None:
+    """
+    Запуск HTTP-сервера метрик в фоновом потоке
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Метрики доступны по адресу http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,152 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Tuple
+
+DAY = 24 * 60 * 60
+
+# локальное время отправки уведомлений, секунды от начала суток
+REMINDER_TIMES = (12 * 60 * 60, 18 * 60 * 60)
+
+
+class ReminderEngine:
+    """
+    Расписание уведомлений, сгруппированное по часовым поясам.
+
+    uid пользователей хранятся в отсортированных массивах array('q') по одному на часовой пояс
+    (8 байт на пользователя), а время срабатывания - в куче по UTC-секунде суток, общей для всех
+    поясов с одинаковым смещением. Поэтому проверка расписания стоит O(log слотов), а отправка
+    O(количества уведомлений к отправке), без объектов-задач на каждого пользователя.
+
+    Изменения add/remove, сделанные во время загрузки, запоминаются и применяются
+    поверх загруженного расписания, чтобы его замена их не потеряла
+    """
+
+    def __init__(self, local_times: Iterable[int] = REMINDER_TIMES):
+        self.local_times = tuple(local_times)
+        self.buckets: dict[int, array] = {}
+        self.slots: dict[int, set] = {}
+        self.heap: List[Tuple[float, int]] = []
+        # uid -> часовой пояс или None для удаленных, пока идет загрузка
+        self.pending: dict[int, int | None] | None = None
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def begin_load(self) -> None:
+        """
+        Начало загрузки: с этого момента add/remove запоминаются для повтора после load.
+        Вызывается перед чтением пользователей, если оно идет вне load
+        """
+        with self.lock:
+            if self.pending is None:
+                self.pending = {}
+
+    def load(self, users: Iterable[Tuple[int, int]], now: float | None = None) -> None:
+        """
+        Полная загрузка расписания из пар (tg_uid, time_zone)
+        """
+        self.begin_load()
+        grouped: dict[int, array] = {}
+        for uid, time_zone in users:
+            time_zone = time_zone or 0
+            if time_zone not in grouped:
+                grouped[time_zone] = array("q")
+            grouped[time_zone].append(uid)
+        buckets = {
+            time_zone: array("q", sorted(uids)) for time_zone, uids in grouped.items()
+        }
+        with self.lock:
+            pending, self.pending = self.pending, None
+            self.buckets = buckets
+            self.slots = {}
+            self.heap = []
+            for time_zone in buckets:
+                self._add_slots(time_zone, now)
+            for uid, time_zone in pending.items():
+                self._discard(uid)
+                if time_zone is not None:
+                    self._insert(uid, time_zone, now)
+
+    def _add_slots(self, time_zone: int, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        for local_time in self.local_times:
+            slot = (local_time - time_zone * 60 * 60) % DAY
+            if slot not in self.slots:
+                self.slots[slot] = set()
+                heapq.heappush(self.heap, (self._next_fire(slot, now), slot))
+            self.slots[slot].add(time_zone)
+
+    @staticmethod
+    def _next_fire(slot: int, now: float) -> float:
+        fire = now - now % DAY + slot
+        return fire if fire > now else fire + DAY
+
+    def next_fire(self) -> float | None:
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: float | None = None) -> List[array]:
+        """
+        Возвращает копии массивов uid всех часовых поясов, время уведомления которых наступило,
+        и переносит эти слоты на следующие сутки
+        """
+        now = time.time() if now is None else now
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, slot = heapq.heappop(self.heap)
+                for time_zone in self.slots[slot]:
+                    bucket = self.buckets.get(time_zone)
+                    if bucket:
+                        due.append(array("q", bucket))
+                heapq.heappush(self.heap, (self._next_fire(slot, now), slot))
+        return due
+
+    def add(self, uid: int, time_zone: int | None) -> None:
+        """
+        Добавление пользователя или перенос его в другой часовой пояс без перезагрузки расписания
+        """
+        time_zone = time_zone or 0
+        with self.lock:
+            if self.pending is not None:
+                self.pending[uid] = time_zone
+            self._discard(uid)
+            self._insert(uid, time_zone)
+
+    update = add
+
+    def remove(self, uid: int) -> bool:
+        with self.lock:
+            if self.pending is not None:
+                self.pending[uid] = None
+            return self._discard(uid)
+
+    def _insert(self, uid: int, time_zone: int, now: float | None = None) -> None:
+        bucket = self.buckets.get(time_zone)
+        if bucket is None:
+            bucket = self.buckets[time_zone] = array("q")
+            self._add_slots(time_zone, now)
+        bucket.insert(bisect_left(bucket, uid), uid)
+
+    def _discard(self, uid: int) -> bool:
+        for bucket in self.buckets.values():
+            index = self._index(bucket, uid)
+            if index is not None:
+                del bucket[index]
+                return True
+        return False
+
+    def __contains__(self, uid: int) -> bool:
+        with self.lock:
+            return any(self._index(bucket, uid) is not None for bucket in self.buckets.values())
+
+    @staticmethod
+    def _index(bucket: array, uid: int) -> int | None:
+        index = bisect_left(bucket, uid)
+        if index < len(bucket) and bucket[index] == uid:
+            return index
+        return None
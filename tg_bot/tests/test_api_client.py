@@ -0,0 +1,71 @@
+"""
+Повторы неидемпотентных запросов клиентов FastApi.
+Запуск из каталога tg_bot: python -m pytest tests
+"""
+
+import asyncio
+import socket
+import threading
+
+import pytest
+from requests.exceptions import ReadTimeout
+
+from api_client import ApiClient
+from async_api_client import AsyncApiClient
+
+
+@pytest.fixture
+def silent_server():
+    """
+    Сервер, который принимает соединения, но не отвечает: запрос доходит, а клиент
+    получает таймаут чтения. Возвращает базовый адрес и список принятых соединений
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    connections = []
+
+    def accept():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            connections.append(connection)
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/api", connections
+    server.close()
+    for connection in connections:
+        connection.close()
+
+
+def test_make_user_is_not_retried_after_read_timeout(silent_server):
+    base_url, connections = silent_server
+    api = ApiClient(base_url=base_url, backoff=0.01, timeout=(1, 0.2))
+    with pytest.raises(ReadTimeout):
+        api.make_user({"tg_uid": 1})
+    assert len(connections) == 1
+
+
+def test_async_make_user_is_not_retried_after_timeout(silent_server):
+    base_url, connections = silent_server
+
+    async def make_user():
+        api = AsyncApiClient(base_url=base_url, backoff=0.01, timeout=0.2)
+        try:
+            await api.make_user({"tg_uid": 1})
+        finally:
+            await api.close()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(make_user())
+    assert len(connections) == 1
+
+
+def test_get_user_is_retried_after_read_timeout(silent_server):
+    base_url, connections = silent_server
+    api = ApiClient(base_url=base_url, retries=2, backoff=0.01, timeout=(1, 0.2))
+    with pytest.raises(ReadTimeout):
+        api.get_user(1)
+    assert len(connections) == 3
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_SNAPSHOT_SIZE = int(os.getenv("USER_SNAPSHOT_SIZE", 10000))
+USER_SNAPSHOT_TTL = float(os.getenv("USER_SNAPSHOT_TTL", 60))
+
+INT_FIELDS = ("repeat_number", "time_zone")
+
+
+class UserSnapshotCache:
+    """
+    Снимки данных пользователей (поле "user" ответа /api/user) по uid с коротким временем жизни.
+    Успешные изменения через API применяются к снимку на месте, поэтому после patch_user
+    повторный get_user не нужен. Наружу отдаются копии, которые обработчики могут изменять
+    """
+
+    def __init__(self, maxsize: int = USER_SNAPSHOT_SIZE, ttl: float = USER_SNAPSHOT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.users: OrderedDict[int, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def copy(user: dict) -> dict:
+        return user | {
+            "habits": dict(user.get("habits") or {}),
+            "completed": list(user.get("completed") or []),
+        }
+
+    def get(self, uid) -> dict | None:
+        uid = int(uid)
+        with self.lock:
+            entry = self.users.get(uid)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires <= time.monotonic():
+                del self.users[uid]
+                return None
+            self.users.move_to_end(uid)
+            return self.copy(user)
+
+    def put(self, uid, user: dict) -> None:
+        uid = int(uid)
+        with self.lock:
+            self.users[uid] = (time.monotonic() + self.ttl, self.copy(user))
+            self.users.move_to_end(uid)
+            while len(self.users) > self.maxsize:
+                self.users.popitem(last=False)
+
+    def update(self, uid, fields: dict) -> None:
+        """
+        Применение изменений к снимку. Если снимка нет, ничего не делает
+        """
+        uid = int(uid)
+        changes = {
+            key: int(value) if key in INT_FIELDS else value
+            for key, value in fields.items()
+            if key != "tg_uid" and value is not None
+        }
+        with self.lock:
+            entry = self.users.get(uid)
+            if entry is not None:
+                expires, user = entry
+                self.users[uid] = (expires, self.copy(user | changes))
+
+    def invalidate(self, uid) -> None:
+        with self.lock:
+            self.users.pop(int(uid), None)
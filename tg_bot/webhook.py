@@ -0,0 +1,200 @@
+import hmac
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from telebot import TeleBot, types
+
+from lanes import LaneDispatcher, update_chat_id
+from metrics import Counter
+
+# публичный адрес вебхука; если не задан, бот работает через long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# сколько секунд запрос ждет места в дорожке, прежде чем получить 503
+WEBHOOK_PUT_TIMEOUT = float(os.getenv("WEBHOOK_PUT_TIMEOUT", 5))
+# одновременных запросов от Telegram (параметр setWebhook)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+# адреса всех реплик через запятую (включая эту) и номер этой реплики в списке
+WEBHOOK_PEERS = [peer.rstrip("/") for peer in os.getenv("WEBHOOK_PEERS", "").split(",") if peer]
+WEBHOOK_REPLICA = int(os.getenv("WEBHOOK_REPLICA", 0))
+MAX_BODY = 1 << 20
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+FORWARDED_HEADER = "X-Bot-Forwarded"
+
+logger = logging.getLogger("webhook")
+
+webhook_updates = Counter(
+    "bot_webhook_updates_total", "Запросы к вебхуку по результату", ("result",)
+)
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram по вебхуку. Обновление из запроса с верным секретом ставится
+    в дорожку его чата (LaneDispatcher), и запрос подтверждается. Если дорожка заполнена
+    дольше put_timeout, запрос получает 503 и Telegram повторит его позже.
+
+    Состояние диалогов хранится в памяти процесса, поэтому при нескольких репликах каждый чат
+    закреплен за одной из них (chat.id по модулю числа реплик): чужие обновления пересылаются
+    реплике-владельцу, а ее ответ, в том числе 503, возвращается Telegram
+    """
+
+    def __init__(
+        self,
+        bot: TeleBot,
+        lanes: LaneDispatcher,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        put_timeout: float = WEBHOOK_PUT_TIMEOUT,
+        peers: list | None = None,
+        replica: int = WEBHOOK_REPLICA,
+    ):
+        self.bot = bot
+        self.lanes = lanes
+        self.path = path
+        self.secret = secret
+        self.put_timeout = put_timeout
+        self.peers = WEBHOOK_PEERS if peers is None else peers
+        self.replica = replica
+        self.session = requests.Session()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        if not secret:
+            logger.warning("WEBHOOK_SECRET не задан: вебхук принимает запросы без проверки")
+
+    @property
+    def port(self) -> int:
+        return self.server.server_port
+
+    def handler_class(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY:
+                    # непрочитанное тело разобралось бы как следующий запрос keep-alive соединения
+                    status = 413
+                    self.close_connection = True
+                elif self.path != webhook.path:
+                    self.rfile.read(length)
+                    status = 404
+                else:
+                    body = self.rfile.read(length)
+                    status = webhook.accept(
+                        body,
+                        self.headers.get(SECRET_HEADER, ""),
+                        bool(self.headers.get(FORWARDED_HEADER)),
+                    )
+                self.send_response(status)
+                if status == 503:
+                    self.send_header("Retry-After", "1")
+                if self.close_connection:
+                    self.send_header("Connection", "close")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                """
+                Проверка готовности для балансировщика: 503, пока заполнена хотя бы одна дорожка
+                """
+                if self.path != "/healthz":
+                    self.send_error(404)
+                    return
+                ready = not webhook.lanes.full()
+                body = json.dumps(webhook.stats()).encode()
+                self.send_response(200 if ready else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def owner(self, chat_id: int) -> int:
+        return chat_id % len(self.peers) if self.peers else self.replica
+
+    def accept(self, body: bytes, secret: str, forwarded: bool = False) -> int:
+        """
+        Прием одного обновления, возвращает HTTP-статус ответа
+        """
+        if self.secret and not hmac.compare_digest(secret, self.secret):
+            webhook_updates.inc("forbidden")
+            return 403
+        try:
+            data = json.loads(body)
+        except ValueError:
+            webhook_updates.inc("bad_request")
+            return 400
+        # реплика выбирается по тому же ключу, что и дорожка
+        update = types.Update.de_json(data)
+        owner = self.owner(update_chat_id(update))
+        if owner != self.replica and not forwarded:
+            return self.forward(owner, body)
+        if not self.lanes.submit(update, timeout=self.put_timeout):
+            webhook_updates.inc("rejected")
+            return 503
+        webhook_updates.inc("accepted")
+        return 200
+
+    def forward(self, owner: int, body: bytes) -> int:
+        headers = {
+            SECRET_HEADER: self.secret,
+            FORWARDED_HEADER: "1",
+            "Content-Type": "application/json",
+        }
+        try:
+            response = self.session.post(
+                f"{self.peers[owner]}{self.path}",
+                data=body,
+                headers=headers,
+                timeout=self.put_timeout + 5,
+            )
+        except requests.RequestException as ex:
+            logger.error(f"Реплика {owner} недоступна: {ex}")
+            webhook_updates.inc("forward_failed")
+            return 503
+        webhook_updates.inc("forwarded")
+        return response.status_code
+
+    def start(self, background: bool = True) -> None:
+        """
+        Запуск HTTP-сервера в фоновом потоке или в текущем до остановки
+        """
+        logger.info(f"Вебхук принимает обновления на порту {self.port}{self.path}")
+        if not background:
+            self.server.serve_forever()
+            return
+        thread = threading.Thread(target=self.server.serve_forever, name="webhook", daemon=True)
+        thread.start()
+
+    def register(self, url: str, max_connections: int = WEBHOOK_MAX_CONNECTIONS) -> None:
+        """
+        Регистрация адреса вебхука в Telegram. При нескольких репликах достаточно одной
+        """
+        self.bot.set_webhook(
+            url=url, secret_token=self.secret or None, max_connections=max_connections
+        )
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> dict:
+        return {"replica": self.replica} | self.lanes.stats()